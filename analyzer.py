@@ -1,21 +1,97 @@
 from scipy.io import wavfile
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib import rcParams
 from scipy import signal
+from scipy import stats
 import os
+import hashlib
+import functools
+import threading
+from collections import OrderedDict
+
+# Import local modules:
+import spectrum_cache as sc
+import session_io as sio
+import decimation as dc
+import bands as bd
+
+# Default parameters of the averaged (Welch) spectrum:
+WELCH_PARAMS = {
+    'segment_length': 2 ** 14,
+    'overlap': 0.5,
+    'window': 'hann',
+    'block_size': 2 ** 18
+}
+
+
+# With sample_rate a wav recording with another sample rate is resampled
+# before its spectrum is computed (FFT spectra only):
+def load_signal(filename, is_filtered=False, filter_params=None,
+                spectrum_mode='fft', welch_params=None, use_cache=True,
+                channel=0, sample_rate=None):
+    if not use_cache:
+        return read_signal(filename,
+                           is_filtered=is_filtered,
+                           filter_params=filter_params,
+                           spectrum_mode=spectrum_mode,
+                           welch_params=welch_params,
+                           channel=channel,
+                           sample_rate=sample_rate)
+
+    # Only the parameters which change the result are a part of the key:
+    cache = sc.get_cache()
+    if spectrum_mode == 'welch':
+        key_welch_params = dict(WELCH_PARAMS)
+        key_welch_params.update(welch_params or {})
+    else:
+        key_welch_params = None
+    key = cache.key(filename,
+                    filter_params=filter_params if is_filtered else None,
+                    spectrum_mode=spectrum_mode,
+                    welch_params=key_welch_params,
+                    channel=channel,
+                    sample_rate=sample_rate)
+
+    cached_spectrum = cache.get(key)
+    if cached_spectrum is not None:
+        return cached_spectrum
+
+    [signal_frequencies, signal_amplitudes] = \
+        read_signal(filename,
+                    is_filtered=is_filtered,
+                    filter_params=filter_params,
+                    spectrum_mode=spectrum_mode,
+                    welch_params=welch_params,
+                    channel=channel,
+                    sample_rate=sample_rate)
+    cache.put(key, signal_frequencies, signal_amplitudes)
+
+    return signal_frequencies, signal_amplitudes
 
 
-def load_signal(filename, is_filtered=False, filter_params=None):
+# Read a file and compute its spectrum (without cache):
+def read_signal(filename, is_filtered=False, filter_params=None,
+                spectrum_mode='fft', welch_params=None, channel=0,
+                sample_rate=None):
     [_, filename_extension] = os.path.splitext(filename)
 
-    if filename_extension == '.txt':
-        [signal_frequencies, signal_amplitudes] = \
-            np.loadtxt(filename, unpack=True)
+    if filename_extension in ['.txt', '.npy']:
+        signal_rate = None
+        if filename_extension == '.txt':
+            [signal_frequencies, signal_amplitudes] = \
+                np.loadtxt(filename, usecols=(0, 1), unpack=True)
+        else:
+            [signal_data, sidecar] = sio.load_columns(filename)
+            signal_frequencies = signal_data[0]
+            signal_amplitudes = signal_data[1]
+            signal_rate = \
+                sidecar['metadata'].get('wf_params', {}).get('sample_rate')
 
         if is_filtered:
-            df = signal_frequencies[1] - signal_frequencies[0]
-            signal_rate = 2*int(df * len(signal_frequencies))
+            if signal_rate is None:
+                # Estimate of the sample rate (the last frequency is close
+                # to the Nyquist frequency):
+                df = signal_frequencies[1] - signal_frequencies[0]
+                signal_rate = round(2 * df * len(signal_frequencies))
             # TODO: add error handler here (critical frequency must be lower
             #  than the nyquist frequency)
             signal_amplitudes = \
@@ -24,11 +100,25 @@ def load_signal(filename, is_filtered=False, filter_params=None):
                                 f_high=filter_params['f_high'],
                                 order=filter_params['order'],
                                 sample_rate=signal_rate,
-                                is_freq_domain=True)
+                                is_freq_domain=True,
+                                frequencies=signal_frequencies)
+
+    elif filename_extension == '.wav' and spectrum_mode == 'welch':
+        [signal_frequencies, signal_amplitudes] = \
+            wav_spectrum_welch(filename,
+                               is_filtered=is_filtered,
+                               filter_params=filter_params,
+                               welch_params=welch_params,
+                               channel=channel)
 
     elif filename_extension == '.wav':
-        [signal_recording, _, _, signal_rate] = \
-            wav_load(filename)
+        recording = WavRecording(filename)
+        signal_recording = recording.to_float(channel=channel)
+        signal_rate = recording.sample_rate
+        if sample_rate is not None and sample_rate != signal_rate:
+            signal_recording = \
+                resample(signal_recording, signal_rate, sample_rate)
+            signal_rate = sample_rate
 
         if is_filtered:
             signal_recording = \
@@ -36,7 +126,9 @@ def load_signal(filename, is_filtered=False, filter_params=None):
                                 f_low=filter_params['f_low'],
                                 f_high=filter_params['f_high'],
                                 order=filter_params['order'],
-                                sample_rate=signal_rate)
+                                sample_rate=signal_rate,
+                                zero_phase=filter_params.get('zero_phase',
+                                                             False))
 
         [signal_frequencies, signal_amplitudes] = \
             signal_spectrum(signal_recording, signal_rate)
@@ -44,111 +136,533 @@ def load_signal(filename, is_filtered=False, filter_params=None):
     return signal_frequencies, signal_amplitudes
 
 
+# With bands (e.g. 3 for 1/3 octave) the band amplitudes are plotted:
 def plot_spectrum(filename_signal,
-                  is_filtered=False, filter_params=None):
+                  is_filtered=False, filter_params=None,
+                  spectrum_mode='fft', welch_params=None, bands=None):
 
     [signal_frequencies, signal_amplitudes] = \
         load_signal(filename_signal,
-                    is_filtered=is_filtered, filter_params=filter_params)
-
-    plt.figure()
-    plt.plot(signal_frequencies, signal_amplitudes)
-    plt.xlabel('Frequency (Hz)')
-    plt.ylabel('Amplitude')
-    if is_filtered:
-        plt.xlim([filter_params['f_low'], filter_params['f_high']])
+                    is_filtered=is_filtered, filter_params=filter_params,
+                    spectrum_mode=spectrum_mode, welch_params=welch_params)
+    if bands is not None:
+        [signal_frequencies, signal_amplitudes] = bd.band_amplitudes(
+            signal_frequencies, signal_amplitudes, fraction=bands,
+            **band_range(signal_frequencies, is_filtered, filter_params))
+
+    # Matplotlib is imported only when something is plotted:
+    import matplotlib.pyplot as plt
+    fig = plt.figure()
+    draw_spectrum(fig, signal_frequencies, signal_amplitudes,
+                  xlim=filter_xlim(is_filtered, filter_params))
     plt.show()
 
 
+# Transmission loss. If filename_reference is None, the reference is
+# another channel of the signal file (multichannel recording). With bands
+# (e.g. 3 for 1/3 octave) the transmission loss of the fractional-octave
+# bands is returned with their center frequencies:
 def get_tl(filename_signal, filename_reference,
-           is_filtered=False, filter_params=None):
+           is_filtered=False, filter_params=None,
+           spectrum_mode='fft', welch_params=None,
+           channel_signal=0, channel_reference=0, is_plotted=True,
+           bands=None):
+
+    [transmission_loss, signal_frequencies,
+     signal_amplitudes, reference_amplitudes] = \
+        compute_tl(filename_signal, filename_reference,
+                   is_filtered=is_filtered, filter_params=filter_params,
+                   spectrum_mode=spectrum_mode, welch_params=welch_params,
+                   channel_signal=channel_signal,
+                   channel_reference=channel_reference)
+
+    if bands is not None and len(transmission_loss) > 0:
+        [transmission_loss, signal_frequencies,
+         signal_amplitudes, reference_amplitudes] = \
+            bd.band_tl(signal_frequencies, signal_amplitudes,
+                       reference_amplitudes, fraction=bands,
+                       **band_range(signal_frequencies, is_filtered,
+                                    filter_params))
+
+    # TODO: add possibility to plot filter in UI
+    if is_plotted:
+        import matplotlib.pyplot as plt
+        fig = plt.figure()
+        draw_tl(fig, signal_frequencies, signal_amplitudes,
+                reference_amplitudes, transmission_loss,
+                xlim=filter_xlim(is_filtered, filter_params))
+        plt.show()
+
+    return transmission_loss, signal_frequencies
+
+
+# Transmission loss and the spectra it is computed from. The spectra are
+# not normalized: spectra of different lengths are only aligned to a common
+# frequency grid (the same transient recorded with trailing silence has
+# the same FFT amplitudes):
+def compute_tl(filename_signal, filename_reference,
+               is_filtered=False, filter_params=None,
+               spectrum_mode='fft', welch_params=None,
+               channel_signal=0, channel_reference=0):
     # TODO: error handler if no path to file was given
+    if filename_reference is None:
+        filename_reference = filename_signal
+
+    # Recordings with different sample rates are compared at the lower one:
+    sample_rate = None
+    if spectrum_mode == 'fft':
+        signal_rate = wav_sample_rate(filename_signal)
+        reference_rate = wav_sample_rate(filename_reference)
+        if None not in [signal_rate, reference_rate] and \
+                signal_rate != reference_rate:
+            sample_rate = min(signal_rate, reference_rate)
+
     [signal_frequencies, signal_amplitudes] = \
         load_signal(filename_signal,
-                    is_filtered=is_filtered, filter_params=filter_params)
+                    is_filtered=is_filtered, filter_params=filter_params,
+                    spectrum_mode=spectrum_mode, welch_params=welch_params,
+                    channel=channel_signal, sample_rate=sample_rate)
 
     [reference_frequencies, reference_amplitudes] = \
         load_signal(filename_reference,
-                    is_filtered=is_filtered, filter_params=filter_params)
-
-    # TODO: add possibility to plot filter in UI
-
-    # TODO: add error handler
-    if np.array_equal(signal_frequencies, reference_frequencies):
-        transmission_loss = 20 * np.log10(
-            np.divide(signal_amplitudes, reference_amplitudes))
+                    is_filtered=is_filtered, filter_params=filter_params,
+                    spectrum_mode=spectrum_mode, welch_params=welch_params,
+                    channel=channel_reference, sample_rate=sample_rate)
+
+    # Spectra of different lengths are compared on a common grid:
+    [signal_frequencies, signal_amplitudes, reference_amplitudes] = \
+        align_spectra(signal_frequencies, signal_amplitudes,
+                      reference_frequencies, reference_amplitudes)
+    transmission_loss = 20 * np.log10(
+        np.divide(signal_amplitudes, reference_amplitudes))
+
+    return transmission_loss, signal_frequencies, \
+        signal_amplitudes, reference_amplitudes
+
+
+# Sample rate of a wav file (None for other files):
+def wav_sample_rate(filename):
+    if os.path.splitext(filename)[1] != '.wav':
+        return None
+    return WavRecording(filename).sample_rate
+
+
+# Two spectra on a common grid: the points of the coarser grid within the
+# frequency range of both spectra. Both spectra are interpolated linearly
+# (if the grids are equal, the spectra are returned as they are):
+def align_spectra(frequencies_a, amplitudes_a, frequencies_b, amplitudes_b):
+    if np.array_equal(frequencies_a, frequencies_b):
+        return frequencies_a, amplitudes_a, amplitudes_b
+
+    step_a = np.ptp(frequencies_a) / (len(frequencies_a) - 1)
+    step_b = np.ptp(frequencies_b) / (len(frequencies_b) - 1)
+    frequencies = frequencies_a if step_a >= step_b else frequencies_b
+    is_common = \
+        (frequencies >= max(frequencies_a[0], frequencies_b[0])) & \
+        (frequencies <= min(frequencies_a[-1], frequencies_b[-1]))
+    frequencies = frequencies[is_common]
+
+    return frequencies, \
+        interpolate_spectrum(frequencies_a, amplitudes_a, frequencies), \
+        interpolate_spectrum(frequencies_b, amplitudes_b, frequencies)
+
+
+# Linear interpolation of spectra [..., bins] to other frequencies (NaN
+# outside of the frequency range):
+def interpolate_spectrum(frequencies, amplitudes, frequencies_new):
+    if np.array_equal(frequencies, frequencies_new):
+        return amplitudes
+    idx = np.clip(np.searchsorted(frequencies, frequencies_new) - 1,
+                  0, len(frequencies) - 2)
+    weights = (frequencies_new - frequencies[idx]) / \
+        (frequencies[idx + 1] - frequencies[idx])
+    amplitudes = np.asarray(amplitudes)
+    amplitudes_new = amplitudes[..., idx] + weights * \
+        (amplitudes[..., idx + 1] - amplitudes[..., idx])
+    is_outside = (frequencies_new < frequencies[0]) | \
+        (frequencies_new > frequencies[-1])
+    amplitudes_new[..., is_outside] = np.nan
+    return amplitudes_new
+
+
+# Polyphase resampling (the anti-aliasing filter is designed once per pair
+# of sample rates):
+@functools.lru_cache(maxsize=16)
+def resampling_plan(rate_in, rate_out):
+    divisor = np.gcd(int(rate_in), int(rate_out))
+    [up, down] = [int(rate_out) // divisor, int(rate_in) // divisor]
+    max_rate = max(up, down)
+    # The same filter as the default one of scipy.signal.resample_poly:
+    window = signal.firwin(2 * 10 * max_rate + 1, 1 / max_rate,
+                           window=('kaiser', 5.0))
+    return up, down, window
+
+
+def resample(audio_signal, rate_in, rate_out):
+    [up, down, window] = resampling_plan(rate_in, rate_out)
+    return signal.resample_poly(audio_signal, up, down, axis=-1,
+                                window=window)
+
+
+# Frequency range of the bands: the filter band or the audible range
+# (within the spectrum):
+def band_range(frequencies, is_filtered, filter_params):
+    if is_filtered:
+        [f_min, f_max] = [filter_params['f_low'], filter_params['f_high']]
     else:
-        transmission_loss = []
+        [f_min, f_max] = [20, 20e3]
+    return {'f_min': max(f_min, frequencies[1]),
+            'f_max': min(f_max, frequencies[-1])}
 
-    # TODO: change to PyQtGraph realization
-    plt.figure()
-    rcParams['xtick.direction'] = 'in'
-    rcParams['ytick.direction'] = 'in'
-
-    plt.subplot(311)
-    plt.plot(signal_frequencies, reference_amplitudes, 'tab:blue')
-    plt.ylabel('Amplitude: reference')
-    plt.xlim(0)
-    if is_filtered:
-        plt.xlim([filter_params['f_low'], filter_params['f_high']])
 
-    plt.subplot(312)
-    plt.plot(reference_frequencies, signal_amplitudes)
-    plt.ylabel('Amplitude: signal')
-    plt.xlim(0)
+# Frequency range to show for filtered signals:
+def filter_xlim(is_filtered, filter_params):
     if is_filtered:
-        plt.xlim([filter_params['f_low'], filter_params['f_high']])
-
-    plt.subplot(313)
-    plt.plot(signal_frequencies, transmission_loss, 'tab:green')
-    plt.axhline(y=0, color='k', linestyle='--', linewidth=1)
-    plt.ylabel('Transmission loss')
-    plt.xlabel('Frequency, Hz')
-    plt.legend(['20 log10(signal/reference)'])
-    plt.xlim(0)
-    if is_filtered:
-        plt.xlim([filter_params['f_low'], filter_params['f_high']])
-
-    plt.tight_layout()
-    plt.show()
-    return transmission_loss, signal_frequencies
+        return [filter_params['f_low'], filter_params['f_high']]
+    return None
+
+
+# Draw a spectrum on a figure. The curve is decimated to the resolution
+# of the axes and redrawn when the view changes:
+def draw_spectrum(fig, frequencies, amplitudes, xlim=None):
+    ax = fig.add_subplot()
+    dc.LodLine(ax, frequencies, amplitudes)
+    ax.set_xlabel('Frequency (Hz)')
+    ax.set_ylabel('Amplitude')
+    if xlim is not None:
+        ax.set_xlim(xlim)
+    return ax
+
+
+# Draw the spectra of the signal and the reference and the transmission
+# loss on a figure (decimated curves, see draw_spectrum):
+def draw_tl(fig, frequencies, signal_amplitudes, reference_amplitudes,
+            transmission_loss, xlim=None):
+    ax_reference = fig.add_subplot(311)
+    dc.LodLine(ax_reference, frequencies, reference_amplitudes, 'tab:blue')
+    ax_reference.set_ylabel('Amplitude: reference')
+
+    ax_signal = fig.add_subplot(312, sharex=ax_reference)
+    dc.LodLine(ax_signal, frequencies, signal_amplitudes)
+    ax_signal.set_ylabel('Amplitude: signal')
+
+    ax_tl = fig.add_subplot(313, sharex=ax_reference)
+    dc.LodLine(ax_tl, frequencies, transmission_loss, 'tab:green')
+    ax_tl.axhline(y=0, color='k', linestyle='--', linewidth=1)
+    ax_tl.set_ylabel('Transmission loss')
+    ax_tl.set_xlabel('Frequency, Hz')
+    ax_tl.legend(['20 log10(signal/reference)'])
+
+    for ax in [ax_reference, ax_signal, ax_tl]:
+        ax.tick_params(direction='in')
+    ax_reference.set_xlim(0)
+    if xlim is not None:
+        ax_reference.set_xlim(xlim)
+
+    fig.tight_layout()
+    return ax_reference, ax_signal, ax_tl
+
+
+# Lazy access to the content of a wav file. The samples are memory-mapped
+# in their stored type; they are converted to float only for the requested
+# channel and time range:
+class WavRecording:
+    def __init__(self, filename):
+        # TODO: check filename
+        self.filename = filename
+        try:
+            self.sample_rate, self.data = wavfile.read(filename, mmap=True)
+        except ValueError:
+            # 24-bit files can not be memory-mapped
+            self.sample_rate, self.data = wavfile.read(filename)
+
+        self.samples = self.data.shape[0]
+        self.channels = 1 if self.data.ndim == 1 else self.data.shape[1]
+        self.duration = self.samples / self.sample_rate
+
+    # Index range for the time range given in seconds:
+    def index_range(self, t_start=0, t_end=None):
+        start = int(round(t_start * self.sample_rate))
+        stop = self.samples if t_end is None else \
+            min(self.samples, int(round(t_end * self.sample_rate)))
+        return start, stop
+
+    # View of the stored samples (no copy). If channel is None, all
+    # channels are returned:
+    def view(self, channel=None, start=0, stop=None):
+        data = self.data[start:stop]
+        if self.data.ndim > 1 and channel is not None:
+            data = data[:, channel]
+        return data
+
+    def time_view(self, t_start=0, t_end=None, channel=None):
+        [start, stop] = self.index_range(t_start, t_end)
+        return self.view(channel=channel, start=start, stop=stop)
+
+    # Float copy of the given range. Integer samples are scaled to [-1, 1),
+    # so files of all sample formats have the same amplitudes:
+    def to_float(self, channel=None, start=0, stop=None):
+        data = self.view(channel=channel, start=start, stop=stop)
+        if data.dtype == np.uint8:
+            return (np.array(data, dtype=float) - 128) / 128
+        elif np.issubdtype(data.dtype, np.integer):
+            # 24-bit samples are read as the upper bytes of int32
+            return np.array(data, dtype=float) / \
+                (np.iinfo(data.dtype).max + 1)
+        return np.array(data, dtype=float)
+
+    # Float blocks of the given range:
+    def blocks(self, block_size=WELCH_PARAMS['block_size'], channel=0,
+               start=0, stop=None):
+        stop = self.samples if stop is None else stop
+        for block_start in range(start, stop, block_size):
+            yield self.to_float(channel=channel, start=block_start,
+                                stop=min(block_start + block_size, stop))
 
 
 # Load the content of a wav file:
-def wav_load(filename):
-    # TODO: check filename
-    sample_rate, recording = wavfile.read(filename)
-    recording = np.array(recording, dtype=float)
-    [frequencies, amplitudes] = signal_spectrum(recording, sample_rate)
-    return recording, frequencies, amplitudes, sample_rate
+def wav_load(filename, compute_spectrum=True):
+    recording = WavRecording(filename)
+    signal_recording = recording.to_float()
+    if compute_spectrum:
+        [frequencies, amplitudes] = \
+            signal_spectrum(signal_recording, recording.sample_rate)
+    else:
+        [frequencies, amplitudes] = [None, None]
+    return signal_recording, frequencies, amplitudes, recording.sample_rate
 
 
-# Fourier transform of a signal
+# Fourier transform of a signal. For 2D input (e.g. [channels, samples])
+# the spectra of all rows are computed at once:
 def signal_spectrum(audio_signal, sample_rate):
-    # Define the number of samples for a given array
-    samples = len(audio_signal)
-
-    # To increase the speed of FFT:
-    audio_channel = np.zeros(2 ** (int(np.ceil(np.log2(samples)))))
-    audio_channel[0:samples] = audio_signal
-
-    # Make the Fourier transform of the signal:
-    signal_fft = np.fft.fft(audio_channel)
-    signal_frequency = np.linspace(0, sample_rate, len(signal_fft))
-
-    # First half is the real component, second half is imaginary:
-    signal_fft_real = signal_fft[0:len(signal_fft) // 2]
-    amplitudes = np.abs(signal_fft_real)
-
-    frequencies = signal_frequency[0:len(signal_fft) // 2]
+    [frequencies, signal_fft] = signal_fft_positive(audio_signal, sample_rate)
+    amplitudes = np.abs(signal_fft)
 
     return frequencies, amplitudes
 
 
-# Filtration
-def filter_bandpass(input_signal, is_freq_domain=False,
-                    f_low=20, f_high=20e3, order=4, sample_rate=44100):
+# Complex spectrum of a signal (positive frequencies only):
+def signal_fft_positive(audio_signal, sample_rate):
+    # Define the number of samples for a given array
+    samples = np.shape(audio_signal)[-1]
+
+    # To increase the speed of FFT the signal is zero-padded to the next
+    # power of two (the real FFT pads it without an extra buffer):
+    len_fft = 2 ** (int(np.ceil(np.log2(samples))))
+    signal_fft = np.fft.rfft(audio_signal, n=len_fft, axis=-1)
+    signal_frequency = np.linspace(0, sample_rate, len_fft)
+
+    # Only positive frequencies are kept:
+    frequencies = signal_frequency[0:len_fft // 2]
+
+    return frequencies, signal_fft[..., 0:len_fft // 2]
+
+
+# Running statistics of spectra over cycles (Welford's algorithm): mean,
+# variance and confidence interval of the amplitudes and, optionally, the
+# coherent (complex) average. Memory does not depend on the number of
+# cycles:
+class SpectrumAccumulator:
+    def __init__(self, is_coherent=False, confidence=0.95):
+        self.is_coherent = is_coherent
+        self.confidence = confidence
+        self.frequencies = None
+        self.count = 0
+        self.mean = None
+        self.m2 = None
+        self.complex_mean = None
+
+    # Add a spectrum; signal_fft is the complex spectrum (needed only for
+    # the coherent average):
+    def update(self, frequencies, amplitudes, signal_fft=None):
+        amplitudes = np.asarray(amplitudes, dtype=float)
+        if self.count == 0:
+            self.frequencies = frequencies
+            self.mean = np.zeros_like(amplitudes)
+            self.m2 = np.zeros_like(amplitudes)
+            if self.is_coherent:
+                self.complex_mean = np.zeros(amplitudes.shape, dtype=complex)
+
+        self.count += 1
+        delta = amplitudes - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (amplitudes - self.mean)
+
+        if self.is_coherent:
+            self.complex_mean += (signal_fft - self.complex_mean) / self.count
+
+    def variance(self):
+        if self.count < 2:
+            return np.full_like(self.mean, np.nan)
+        return self.m2 / (self.count - 1)
+
+    def std(self):
+        return np.sqrt(self.variance())
+
+    # Confidence interval of the mean amplitude (Student's t):
+    def confidence_interval(self):
+        if self.count < 2:
+            half_width = np.full_like(self.mean, np.nan)
+        else:
+            t_value = stats.t.ppf(0.5 + 0.5 * self.confidence,
+                                  self.count - 1)
+            half_width = t_value * self.std() / np.sqrt(self.count)
+        return self.mean - half_width, self.mean + half_width
+
+    def coherent_amplitudes(self):
+        if self.complex_mean is None:
+            return None
+        return np.abs(self.complex_mean)
+
+
+# Amplitudes of a tone and its harmonics (single-bin DFT at the exact
+# frequency, i.e. projection on cosine and sine). It costs O(N) per signal
+# and is computed at once for all leading axes (e.g. [cycles, channels,
+# samples]). The result has the shape [..., harmonics]; harmonics above
+# the Nyquist frequency are NaN:
+def tone_amplitudes(audio_signal, freq, sample_rate, harmonics=1):
+    audio_signal = np.asarray(audio_signal, dtype=float)
+    samples = audio_signal.shape[-1]
+    phase_step = 2 * np.pi * np.arange(samples) / sample_rate
+
+    amplitudes = np.full(audio_signal.shape[:-1] + (harmonics,), np.nan)
+    for harmonic in range(1, harmonics + 1):
+        if harmonic * freq >= 0.5 * sample_rate:
+            break
+        kernel = np.exp(-1j * harmonic * freq * phase_step)
+        amplitudes[..., harmonic - 1] = \
+            2 * np.abs(audio_signal @ kernel) / samples
+
+    return amplitudes
+
+
+# Read a wav file block by block (the data is memory-mapped, so only the
+# current block is converted to float):
+def wav_blocks(filename, block_size=WELCH_PARAMS['block_size'], channel=0):
+    recording = WavRecording(filename)
+    return recording.sample_rate, \
+        recording.blocks(block_size=block_size, channel=channel)
+
+
+# Running averaged (Welch) spectrum. Blocks of a signal are added as they
+# arrive; the segments overlapping two blocks are kept in a short tail.
+# Blocks may have leading axes (e.g. [channels, samples]). A signal shorter
+# than a segment is a single segment of its own length (as in
+# scipy.signal.welch):
+class WelchAccumulator:
+    def __init__(self, sample_rate,
+                 segment_length=WELCH_PARAMS['segment_length'],
+                 overlap=WELCH_PARAMS['overlap'],
+                 window=WELCH_PARAMS['window']):
+        self.sample_rate = sample_rate
+        self.segment_length = segment_length
+        self.hop = max(1, int(segment_length * (1 - overlap)))
+        self.window = window
+        self.window_values = signal.get_window(window, segment_length)
+
+        self.power_sum = 0
+        self.segments = 0
+        self.tail = None
+
+    def update(self, block):
+        block = np.asarray(block, dtype=float)
+        buffer = block if self.tail is None else \
+            np.concatenate((self.tail, block), axis=-1)
+        if buffer.shape[-1] < self.segment_length:
+            self.tail = buffer
+            return
+
+        frames = np.lib.stride_tricks.sliding_window_view(
+            buffer, self.segment_length, axis=-1)[..., ::self.hop, :]
+        segments_fft = np.fft.rfft(frames * self.window_values, axis=-1)
+        self.power_sum = self.power_sum + \
+            np.sum(np.abs(segments_fft) ** 2, axis=-2)
+        self.segments += frames.shape[-2]
+
+        # Keep the samples that belong to the next (overlapping) segment:
+        self.tail = buffer[..., frames.shape[-2] * self.hop:]
+
+    def result(self):
+        power_sum = self.power_sum
+        segments = self.segments
+        window_values = self.window_values
+
+        # Signal shorter than a single segment (the segment and the window
+        # are shortened to the samples available):
+        if segments == 0 and self.tail is not None and \
+                self.tail.shape[-1] > 0:
+            window_values = signal.get_window(self.window,
+                                              self.tail.shape[-1])
+            power_sum = \
+                np.abs(np.fft.rfft(self.tail * window_values, axis=-1)) ** 2
+            segments = 1
+
+        # Amplitude scaling (a sine of amplitude A gives a peak close to A):
+        amplitudes = 2 * np.sqrt(power_sum / max(segments, 1)) / \
+            np.sum(window_values)
+        frequencies = np.fft.rfftfreq(len(window_values),
+                                      d=1 / self.sample_rate)
+
+        return frequencies, amplitudes
+
+
+# Averaged (Welch) amplitude spectrum of a stream of signal blocks.
+# Memory use depends on the segment and block lengths only, not on the
+# total length of the signal:
+def signal_spectrum_welch(signal_blocks, sample_rate,
+                          segment_length=WELCH_PARAMS['segment_length'],
+                          overlap=WELCH_PARAMS['overlap'],
+                          window=WELCH_PARAMS['window']):
+    accumulator = WelchAccumulator(sample_rate,
+                                   segment_length=segment_length,
+                                   overlap=overlap, window=window)
+    for block in signal_blocks:
+        accumulator.update(block)
+
+    return accumulator.result()
+
+
+# Averaged spectrum of a wav file read block by block:
+def wav_spectrum_welch(filename, is_filtered=False, filter_params=None,
+                       welch_params=None, channel=0):
+    params = dict(WELCH_PARAMS)
+    if welch_params is not None:
+        params.update(welch_params)
+
+    [signal_rate, signal_blocks] = \
+        wav_blocks(filename, block_size=params['block_size'],
+                   channel=channel)
 
+    if is_filtered:
+        signal_blocks = \
+            filter_blocks(signal_blocks,
+                          f_low=filter_params['f_low'],
+                          f_high=filter_params['f_high'],
+                          order=filter_params['order'],
+                          sample_rate=signal_rate)
+
+    return signal_spectrum_welch(signal_blocks, signal_rate,
+                                 segment_length=params['segment_length'],
+                                 overlap=params['overlap'],
+                                 window=params['window'])
+
+
+# Band-pass filtration of a stream of blocks (the filter state is kept
+# between blocks):
+def filter_blocks(signal_blocks, f_low=20, f_high=20e3, order=4,
+                  sample_rate=44100):
+    bandpass = BandpassFilter(f_low=f_low, f_high=f_high, order=order,
+                              sample_rate=sample_rate)
+
+    for block in signal_blocks:
+        yield bandpass.process(block)
+
+
+# Butterworth band-pass design (second-order sections). Designs are
+# memoized, so repeated calls with the same parameters are free (the
+# returned array is shared and must not be modified):
+@functools.lru_cache(maxsize=64)
+def butter_bandpass_sos(order, f_low, f_high, sample_rate):
     # Cutoff frequencies (as fractions of Nyquist frequency):
     freq_nyquist = 0.5 * sample_rate
     low_pass = f_low / freq_nyquist
@@ -158,11 +672,93 @@ def filter_bandpass(input_signal, is_freq_domain=False,
     sos = signal.butter(order, [low_pass, high_pass],
                         btype='band', analog=False,
                         output='sos')
+    return sos
+
+
+# Band-pass filter. process() filters consecutive blocks of a long signal
+# keeping the filter state between them; filter() filters a whole signal,
+# with zero_phase=True forward and backward (sosfiltfilt). Signals may be
+# 2D (e.g. [channels, samples] or [cycles, samples]), the filtration runs
+# along the last axis:
+class BandpassFilter:
+    def __init__(self, f_low=20, f_high=20e3, order=4, sample_rate=44100,
+                 zero_phase=False):
+        self.sos = butter_bandpass_sos(int(order), float(f_low),
+                                       float(f_high), float(sample_rate))
+        self.zero_phase = zero_phase
+        self.zi = None
+
+    def reset(self):
+        self.zi = None
+
+    def process(self, block):
+        if self.zero_phase:
+            raise ValueError("Zero-phase filtration can not be done "
+                             "block by block!")
+        block = np.asarray(block, dtype=float)
+        if self.zi is None:
+            self.zi = np.zeros((self.sos.shape[0],) + block.shape[:-1] + (2,))
+        [block_filtered, self.zi] = \
+            signal.sosfilt(self.sos, block, axis=-1, zi=self.zi)
+        return block_filtered
+
+    def filter(self, input_signal):
+        if self.zero_phase:
+            return signal.sosfiltfilt(self.sos, input_signal, axis=-1)
+        return signal.sosfilt(self.sos, input_signal, axis=-1)
+
+
+# Magnitude responses of band-pass filters evaluated on frequency grids,
+# kept for the latest filter parameters and grids:
+RESPONSE_TABLES_SIZE = 32
+response_tables = OrderedDict()
+response_tables_lock = threading.Lock()
+
+
+def bandpass_response(frequencies, f_low=20, f_high=20e3, order=4,
+                      sample_rate=44100):
+    frequencies = np.ascontiguousarray(frequencies, dtype=float)
+    key = (int(order), float(f_low), float(f_high), float(sample_rate),
+           hashlib.sha1(frequencies.tobytes()).hexdigest())
+
+    with response_tables_lock:
+        if key in response_tables:
+            response_tables.move_to_end(key)
+            return response_tables[key]
+
+    sos = butter_bandpass_sos(*key[0:4])
+    [_, h] = signal.sosfreqz(sos, worN=frequencies, fs=sample_rate)
+    response = np.abs(h)
+    response.flags.writeable = False
+
+    with response_tables_lock:
+        response_tables[key] = response
+        while len(response_tables) > RESPONSE_TABLES_SIZE:
+            response_tables.popitem(last=False)
+
+    return response
+
+
+# Filtration. In the frequency domain the magnitude response is applied
+# to the spectrum (to all spectra at once for 2D input); without the
+# frequencies of the spectrum the bins are assumed to cover [0, Nyquist):
+def filter_bandpass(input_signal, is_freq_domain=False,
+                    f_low=20, f_high=20e3, order=4, sample_rate=44100,
+                    zero_phase=False, frequencies=None):
+
     if is_freq_domain:
-        w, h = signal.sosfreqz(sos, worN=len(input_signal))
-        output_signal = np.multiply(input_signal, np.abs(h))
+        if frequencies is None:
+            bins = np.shape(input_signal)[-1]
+            frequencies = 0.5 * sample_rate * np.arange(bins) / bins
+        response = bandpass_response(frequencies, f_low=f_low,
+                                     f_high=f_high, order=order,
+                                     sample_rate=sample_rate)
+        output_signal = np.multiply(input_signal, response)
     else:
-        output_signal = signal.sosfilt(sos, input_signal)
+        bandpass = BandpassFilter(f_low=f_low, f_high=f_high, order=order,
+                                  sample_rate=sample_rate,
+                                  zero_phase=zero_phase)
+        output_signal = bandpass.filter(input_signal)
 
     return output_signal
 
@@ -171,12 +767,13 @@ def filter_bandpass(input_signal, is_freq_domain=False,
 def wav_analysis(path2recording, filename, plot_spectrum=True):
     # Load the content of a wav file:
     filepath = '{}/{}'.format(path2recording, filename)
-    rate, recording = wavfile.read('{}.wav'.format(filepath))
-    recording = np.array(recording, dtype=float)
-    [frequencies, amplitudes] = signal_spectrum(recording, rate)
+    recording = WavRecording('{}.wav'.format(filepath))
+    [frequencies, amplitudes] = \
+        signal_spectrum(recording.to_float(channel=0), recording.sample_rate)
 
     # Plot spectrum of the signal:
     if plot_spectrum:
+        import matplotlib.pyplot as plt
         plt.figure()
         plt.plot(frequencies, amplitudes)
         plt.xlabel('Frequency, Hz')
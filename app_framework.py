@@ -1,19 +1,72 @@
 import sys
+import time
 import datetime
-from PyQt5 import QtWidgets
-from pathlib import Path
+import threading
+from PyQt5 import QtWidgets, QtCore
 import matplotlib.pyplot as plt
 
 # Import local modules:
 import recorder as gr
 import analyzer as an
+import spectrogram as sg
 from gui_main_window import Ui_MainWindow
 
 
+# Runs a generate/record workflow outside of the GUI thread and reports
+# its progress with signals:
+class MeasurementWorker(QtCore.QObject):
+    # Progress: (done, total, remaining time in seconds)
+    progress = QtCore.pyqtSignal(int, int, float)
+    # Result of a sweep step: (frequency, amplitudes)
+    step_result = QtCore.pyqtSignal(float, object)
+    # End of the measurement: (message)
+    ended = QtCore.pyqtSignal(str)
+
+    def __init__(self, wf_params, path2save):
+        super(MeasurementWorker, self).__init__()
+        self.wf_params = wf_params
+        self.path2save = path2save
+        self.cancel_event = threading.Event()
+        self.time_start = None
+
+    def run(self):
+        self.time_start = time.monotonic()
+        try:
+            gr.gr_workflow(self.wf_params, self.path2save,
+                           progress=self.report_progress,
+                           cancel=self.cancel_event)
+        except gr.MeasurementCancelled:
+            self.ended.emit("Measurement cancelled")
+        except Exception as error:
+            self.ended.emit("Measurement failed: {}".format(error))
+        else:
+            self.ended.emit("Measurement finished")
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def report_progress(self, info):
+        if info['stage'] == 'step':
+            [done, total] = [info['step'] + 1, info['steps']]
+            self.step_result.emit(float(info['freq']), info['amplitudes'])
+        elif self.wf_params['type'] == 'sweep':
+            # Cycles of a sweep step are not reported separately
+            return
+        else:
+            [done, total] = [info['cycle'] + 1, info['cycles']]
+
+        elapsed = time.monotonic() - self.time_start
+        remaining = elapsed / done * (total - done)
+        self.progress.emit(done, total, remaining)
+
+
 class MyWindow(QtWidgets.QMainWindow, Ui_MainWindow):
     def __init__(self):
         super(MyWindow, self).__init__()
         self.setupUi(self)
+        self.measurement_thread = None
+        self.measurement_worker = None
+        self.last_step_result = None
 
         # Main menu
         self.actionQuit.triggered.connect(self.close_app)
@@ -40,6 +93,7 @@ class MyWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         self.btnPlot_rec.clicked.connect(lambda: self.plot_signal('recording'))
         self.btnPlot_ref.clicked.connect(lambda: self.plot_signal('reference'))
         self.btnPlot_tl.clicked.connect(self.plot_tl)
+        self.btnPlot_spectrogram.clicked.connect(self.plot_spectrogram)
 
     def plot_signal(self, signal_type):
         if signal_type == 'recording':
@@ -66,19 +120,65 @@ class MyWindow(QtWidgets.QMainWindow, Ui_MainWindow):
                                            "Error",
                                            error_msg)
         else:
-            an.plot_spectrum(path_signal,
-                             is_filtered=is_filtered,
-                             filter_params=filter_params)
+            self.plot_file(path_signal,
+                           is_filtered=is_filtered,
+                           filter_params=filter_params)
+
+    def plot_file(self, path_signal, is_filtered=False, filter_params=None):
+        [signal_frequencies, signal_amplitudes] = \
+            an.load_signal(path_signal,
+                           is_filtered=is_filtered,
+                           filter_params=filter_params)
+        self.plot_widget.plot_spectrum(
+            signal_frequencies, signal_amplitudes,
+            xlim=an.filter_xlim(is_filtered, filter_params))
+
+    # Spectrogram of the recording (computed once and memory-mapped, see
+    # spectrogram.get_spectrogram):
+    def plot_spectrogram(self):
+        path_signal = self.lineEdit_filename_rec.text()
+
+        if self.checkBox_tl_filter.isChecked():
+            is_filtered = True
+            filter_params = {
+                'f_low': float(self.lineEdit_tl_filter_f_low.text()),
+                'f_high': float(self.lineEdit_tl_filter_f_high.text()),
+                'order': self.spinBox_tl_filter_order.value()
+            }
+        else:
+            is_filtered = False
+            filter_params = None
+
+        if path_signal == '':
+            error_msg = "You have not selected file with recording!"
+            QtWidgets.QMessageBox.critical(self,
+                                           "Error",
+                                           error_msg)
+        elif not path_signal.endswith('.wav'):
+            error_msg = "Spectrogram can be plotted for *.wav files only!"
+            QtWidgets.QMessageBox.critical(self,
+                                           "Error",
+                                           error_msg)
+        else:
+            self.statusbar.showMessage("Computing the spectrogram...")
+            [spectrogram, times, frequencies] = \
+                sg.get_spectrogram(path_signal,
+                                   is_filtered=is_filtered,
+                                   filter_params=filter_params)
+            self.plot_widget.plot_spectrogram(spectrogram, times,
+                                              frequencies)
+            self.statusbar.clearMessage()
 
     def plot_signal_quick(self):
         [path_signal, _] = \
-            QtWidgets.QFileDialog.getOpenFileName(self,
-                                                  'Open file with recording',
-                                                  'recording (*.wav, *.txt)')
+            QtWidgets.QFileDialog.getOpenFileName(
+                self, 'Open file with recording',
+                'recording (*.wav, *.txt, *.npy)')
         # TODO: check file
         if path_signal != '':
-            an.plot_spectrum(path_signal,
-                             is_filtered=False, filter_params=None)
+            self.tabWidget.setCurrentWidget(self.tab_analysis)
+            self.plot_file(path_signal,
+                           is_filtered=False, filter_params=None)
 
     def plot_tl(self):
         filename_signal = self.lineEdit_filename_rec.text()
@@ -106,8 +206,15 @@ class MyWindow(QtWidgets.QMainWindow, Ui_MainWindow):
                                            "Error",
                                            error_msg)
         else:
-            an.get_tl(filename_signal, filename_reference,
-                      is_filtered=is_filtered, filter_params=filter_params)
+            [transmission_loss, signal_frequencies,
+             signal_amplitudes, reference_amplitudes] = \
+                an.compute_tl(filename_signal, filename_reference,
+                              is_filtered=is_filtered,
+                              filter_params=filter_params)
+            self.plot_widget.plot_tl(
+                signal_frequencies, signal_amplitudes, reference_amplitudes,
+                transmission_loss,
+                xlim=an.filter_xlim(is_filtered, filter_params))
 
     def browse_files_signal(self):
         [path_signal, _] = \
@@ -126,7 +233,8 @@ class MyWindow(QtWidgets.QMainWindow, Ui_MainWindow):
     def switch_wf_inputs(self):
         state = self.comboBox_wfparam_type.currentText()
         # TODO: check more elegant way for that switcher
-        if state == 'chirp':
+        if state in ['chirp', 'log_sweep', 'multisine',
+                     'impulse_response']:
             self.label_wfparam_freq_sin.hide()
             self.lineEdit_wfparam_freq_sin.hide()
 
@@ -155,6 +263,19 @@ class MyWindow(QtWidgets.QMainWindow, Ui_MainWindow):
             self.label_wfparam_freq_sin.show()
             self.lineEdit_wfparam_freq_sin.show()
 
+            self.label_wfparam_freq_start.hide()
+            self.lineEdit_wfparam_freq_start.hide()
+            self.label_wfparam_freq_end.hide()
+            self.lineEdit_wfparam_freq_end.hide()
+            self.label_wfparam_freq_step.hide()
+            self.lineEdit_wfparam_freq_step.hide()
+            self.label_wfparam_sweep_pause.hide()
+            self.lineEdit_wfparam_sweep_pause.hide()
+        else:
+            # Noise and MLS have no frequency parameters
+            self.label_wfparam_freq_sin.hide()
+            self.lineEdit_wfparam_freq_sin.hide()
+
             self.label_wfparam_freq_start.hide()
             self.lineEdit_wfparam_freq_start.hide()
             self.label_wfparam_freq_end.hide()
@@ -173,11 +294,22 @@ class MyWindow(QtWidgets.QMainWindow, Ui_MainWindow):
                 QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No)
 
         if choice == QtWidgets.QMessageBox.Yes:
+            if self.measurement_worker is not None:
+                self.measurement_worker.cancel()
+                self.measurement_thread.quit()
+                self.measurement_thread.wait()
             sys.exit()
         else:
             pass
 
     def start_gen_rec(self):
+        # The start button cancels a running measurement:
+        if self.measurement_worker is not None:
+            self.measurement_worker.cancel()
+            self.btnStart.setEnabled(False)
+            self.statusbar.showMessage("Cancelling the measurement...")
+            return
+
         # TODO: Add type check here
         wf_params = {
             'type': self.comboBox_wfparam_type.currentText(),
@@ -189,7 +321,8 @@ class MyWindow(QtWidgets.QMainWindow, Ui_MainWindow):
 
         if wf_params['type'] == 'sin':
             wf_params['freq'] = float(self.lineEdit_wfparam_freq_sin.text())
-        elif wf_params['type'] in ['chirp', 'sweep']:
+        elif wf_params['type'] in ['chirp', 'sweep', 'log_sweep',
+                                   'multisine', 'impulse_response']:
             wf_params['f_start'] = \
                 float(self.lineEdit_wfparam_freq_start.text())
             wf_params['f_end'] = float(self.lineEdit_wfparam_freq_end.text())
@@ -200,49 +333,48 @@ class MyWindow(QtWidgets.QMainWindow, Ui_MainWindow):
                 float(self.lineEdit_wfparam_sweep_pause.text())
 
         # TODO: allow users to select path to save the results
-        # Define paths to save the recorded signal:
-        current_datetime = datetime.datetime.now()
-        current_timestamp = current_datetime.strftime("%Y-%m-%d-%H-%M-%S")
-
-        dir_results = 'recordings'
-        Path(dir_results).mkdir(parents=True, exist_ok=True)
-
-        path2save = '{}/{}'.format(dir_results, current_timestamp)
-        Path(path2save).mkdir(parents=True, exist_ok=True)
-
-        # Save the parameters:
-        file_header = (
-            "Simultaneous generation and recording of sound signals. \n\n"
-            "Parameters of the generated signal: \n"
-        )
-        file_footer = (
-            "\n\n"
-            "All frequencies are given in Hz and all time measures"
-            " are in seconds. \n\n"
-            "Recording started at {} "
-        ).format(current_timestamp)
-
-        with open('{}/parameters.txt'.format(path2save), 'a') as \
-                file2save_param:
-            file2save_param.write(file_header)
-            for key, value in wf_params.items():
-                file2save_param.write("{}: {}\n".format(key, value))
-            file2save_param.write(file_footer)
-
-        # Generate and record signals:
-        gr.gr_workflow(wf_params, path2save)
+        # Define paths to save the recorded signal and save the parameters:
+        path2save = gr.create_session(wf_params, dir_results='recordings')
+
+        # Generate and record signals in a worker thread:
+        self.measurement_thread = QtCore.QThread()
+        self.measurement_worker = MeasurementWorker(wf_params, path2save)
+        self.measurement_worker.moveToThread(self.measurement_thread)
+        self.measurement_thread.started.connect(self.measurement_worker.run)
+
+        self.measurement_worker.progress.connect(self.show_progress)
+        self.measurement_worker.step_result.connect(self.show_step_result)
+        self.measurement_worker.ended.connect(self.end_gen_rec)
+
+        self.last_step_result = None
+        self.btnStart.setText("Cancel")
+        self.statusbar.showMessage("Measurement started")
+        self.measurement_thread.start()
+
+    def show_progress(self, done, total, remaining):
+        message = "Measurement: {} from {} done, about {} remaining".format(
+            done, total, datetime.timedelta(seconds=int(round(remaining))))
+        if self.last_step_result is not None:
+            message += " (last step: {} Hz, amplitude {:.4g})".format(
+                *self.last_step_result)
+        self.statusbar.showMessage(message)
+
+    def show_step_result(self, freq, amplitudes):
+        self.last_step_result = (freq, amplitudes.ravel()[0])
+
+    def end_gen_rec(self, message):
+        path2save = self.measurement_worker.path2save
+        self.measurement_thread.quit()
+        self.measurement_thread.wait()
+        self.measurement_thread = None
+        self.measurement_worker = None
+
+        self.btnStart.setText("Start")
+        self.btnStart.setEnabled(True)
+        self.statusbar.showMessage(message)
 
         # Save timestamp corresponding to the end of workflow:
-        end_workflow_datetime = datetime.datetime.now()
-        end_workflow_timestamp = \
-            end_workflow_datetime.strftime("%Y-%m-%d-%H-%M-%S")
-        file_footer = (
-            "and ended at {}.\n"
-        ).format(end_workflow_timestamp)
-
-        with open('{}/parameters.txt'.format(path2save), 'a') as \
-                file2save_param:
-            file2save_param.write(file_footer)
+        gr.close_session(path2save)
 
 
 if __name__ == '__main__':
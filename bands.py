@@ -0,0 +1,111 @@
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# Fractional-octave bands (1/1, 1/3, ... octave) with base-10 center
+# frequencies as in IEC 61260: 1000 * G ** (k / fraction) for odd and
+# 1000 * G ** ((2 * k + 1) / (2 * fraction)) for even fractions,
+# G = 10 ** 0.3.
+# Spectra are reduced to band levels with one np.add.reduceat over the
+# bins; the bin-to-band maps are kept for the latest frequency grids.
+
+OCTAVE_RATIO = 10 ** 0.3
+REFERENCE_FREQUENCY = 1000
+
+BAND_MAPS_SIZE = 32
+band_maps = OrderedDict()
+band_maps_lock = threading.Lock()
+
+
+# Center frequencies and edges of the bands overlapping [f_min, f_max]:
+def band_frequencies(fraction=3, f_min=20, f_max=20e3):
+    # Even fractions have no band at the reference frequency:
+    offset = 0.5 if fraction % 2 == 0 else 0
+    idx_min = int(np.ceil(fraction * np.log(f_min / REFERENCE_FREQUENCY) /
+                          np.log(OCTAVE_RATIO) - 0.5 - offset))
+    idx_max = int(np.floor(fraction * np.log(f_max / REFERENCE_FREQUENCY) /
+                           np.log(OCTAVE_RATIO) + 0.5 - offset))
+    centers = REFERENCE_FREQUENCY * OCTAVE_RATIO ** \
+        ((np.arange(idx_min, idx_max + 1) + offset) / fraction)
+    edges_low = centers * OCTAVE_RATIO ** (-1 / (2 * fraction))
+    edges_high = centers * OCTAVE_RATIO ** (1 / (2 * fraction))
+    return centers, edges_low, edges_high
+
+
+# Bins of the bands on a frequency grid (sorted): the first bin of every
+# band and the number of bins in it. Consecutive bands share their edges,
+# so all bands are covered by the bins [bins_start[0], bins_end):
+class BandMap:
+    def __init__(self, frequencies, fraction=3, f_min=20, f_max=20e3):
+        frequencies = np.asarray(frequencies)
+        [self.centers, self.edges_low, self.edges_high] = \
+            band_frequencies(fraction, f_min, f_max)
+
+        edges = np.append(self.edges_low, self.edges_high[-1])
+        bins_edges = np.searchsorted(frequencies, edges)
+        self.bins_start = bins_edges[:-1]
+        self.bins_count = np.diff(bins_edges)
+        self.bins_end = bins_edges[-1]
+
+    # Sum of the values of every band ([..., bins] -> [..., bands]); the
+    # bands without bins are NaN:
+    def reduce(self, values):
+        values = np.asarray(values)
+        bands = len(self.bins_count)
+        result = np.full(values.shape[:-1] + (bands,), np.nan)
+        is_filled = self.bins_count > 0
+        if not np.any(is_filled):
+            return result
+
+        offset = self.bins_start[0]
+        values_bands = values[..., offset:self.bins_end]
+        # reduceat does not handle empty bands (and a start at the end):
+        result[..., is_filled] = np.add.reduceat(
+            values_bands, self.bins_start[is_filled] - offset, axis=-1)
+        return result
+
+
+def get_band_map(frequencies, fraction=3, f_min=20, f_max=20e3):
+    frequencies = np.ascontiguousarray(frequencies, dtype=float)
+    key = (fraction, float(f_min), float(f_max),
+           hashlib.sha1(frequencies.tobytes()).hexdigest())
+
+    with band_maps_lock:
+        if key in band_maps:
+            band_maps.move_to_end(key)
+            return band_maps[key]
+
+    band_map = BandMap(frequencies, fraction=fraction, f_min=f_min,
+                       f_max=f_max)
+
+    with band_maps_lock:
+        band_maps[key] = band_map
+        while len(band_maps) > BAND_MAPS_SIZE:
+            band_maps.popitem(last=False)
+
+    return band_map
+
+
+# Band amplitudes of amplitude spectra [..., bins]: the root of the energy
+# of the bins in every band. Returns the center frequencies and the band
+# amplitudes [..., bands]:
+def band_amplitudes(frequencies, amplitudes, fraction=3, f_min=20,
+                    f_max=20e3):
+    band_map = get_band_map(frequencies, fraction=fraction, f_min=f_min,
+                            f_max=f_max)
+    return band_map.centers, np.sqrt(band_map.reduce(np.square(amplitudes)))
+
+
+# Band transmission loss from the spectra of the signal and the reference:
+def band_tl(frequencies, signal_amplitudes, reference_amplitudes,
+            fraction=3, f_min=20, f_max=20e3):
+    [centers, signal_bands] = band_amplitudes(
+        frequencies, signal_amplitudes, fraction=fraction, f_min=f_min,
+        f_max=f_max)
+    [_, reference_bands] = band_amplitudes(
+        frequencies, reference_amplitudes, fraction=fraction, f_min=f_min,
+        f_max=f_max)
+    transmission_loss = 20 * np.log10(
+        np.divide(signal_bands, reference_bands))
+    return transmission_loss, centers, signal_bands, reference_bands
@@ -0,0 +1,317 @@
+import os
+import sys
+import json
+import time
+import types
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+import numpy as np
+from scipy.io import wavfile
+
+# Import local modules:
+import analyzer as an
+import spectrum_cache as sc
+import excitation as ex
+import bands as bd
+
+# Benchmarks of the analyzer and recorder hot paths. Every case is run for
+# the given signal lengths and channel counts; wall time, throughput and
+# peak memory (of Python and NumPy allocations) are saved as JSON, which
+# can be compared between commits:
+#   python benchmarks.py -o before.json
+#   python benchmarks.py -o after.json --compare before.json
+
+SAMPLE_RATE = 48000
+
+
+# Audio device replacement for the recorder: the generated signal is
+# "recorded" back on every input channel.
+class FakeAudioDevice(types.ModuleType):
+    def __init__(self):
+        super(FakeAudioDevice, self).__init__('sounddevice')
+
+    @staticmethod
+    def playrec(data, samplerate=None, channels=1, input_mapping=None,
+                **kwargs):
+        if input_mapping is not None:
+            channels = len(input_mapping)
+        return np.repeat(np.asarray(data, dtype='float32')[:, np.newaxis],
+                         channels, axis=1)
+
+    @staticmethod
+    def wait():
+        pass
+
+
+def import_recorder():
+    try:
+        import sounddevice
+    except (ImportError, OSError):
+        # No PortAudio on the machine
+        sys.modules['sounddevice'] = FakeAudioDevice()
+    import recorder as gr
+    gr.sd = FakeAudioDevice()
+    return gr
+
+
+def test_signal(samples, channels):
+    timestamps = np.arange(samples) / SAMPLE_RATE
+    audio_signal = np.sin(2 * np.pi * 1000 * timestamps) + \
+        0.1 * np.random.default_rng(0).standard_normal((channels, samples))
+    return audio_signal if channels > 1 else audio_signal[0]
+
+
+# Cases: name -> (preparation, benchmarked function, maximum length).
+# The preparation returns the arguments of the function and is not timed.
+def prepare_array(samples, channels, path2tmp):
+    return (test_signal(samples, channels),)
+
+
+def prepare_wav(samples, channels, path2tmp):
+    filename = '{}/signal_{}_{}.wav'.format(path2tmp, samples, channels)
+    if not os.path.isfile(filename):
+        wavfile.write(filename, SAMPLE_RATE,
+                      test_signal(samples, channels).T.astype('float32'))
+    return (filename,)
+
+
+def prepare_txt(samples, channels, path2tmp):
+    filename = '{}/spectrum_{}.txt'.format(path2tmp, samples)
+    if not os.path.isfile(filename):
+        [frequencies, amplitudes] = \
+            an.signal_spectrum(test_signal(samples, 1), SAMPLE_RATE)
+        np.savetxt(filename, np.c_[frequencies, amplitudes])
+    return (filename,)
+
+
+def prepare_spectrum(samples, channels, path2tmp):
+    [_, amplitudes] = \
+        an.signal_spectrum(test_signal(samples, channels), SAMPLE_RATE)
+    return (amplitudes,)
+
+
+def prepare_timestamps(samples, channels, path2tmp):
+    return (np.arange(samples) / SAMPLE_RATE,)
+
+
+def prepare_recorder(samples, channels, path2tmp):
+    wf_params = {
+        'type': 'chirp',
+        'duration': samples / SAMPLE_RATE,
+        'sample_rate': SAMPLE_RATE,
+        'cycles': 4,
+        'cycles_pause': 0,
+        'f_start': 20,
+        'f_end': 20000,
+        'channels': channels
+    }
+    return (wf_params,)
+
+
+FILTER_PARAMS = {'f_low': 100, 'f_high': 10000, 'order': 4}
+
+
+def benchmark_cases(gr):
+    return {
+        'signal_spectrum': (
+            prepare_array,
+            lambda audio_signal: an.signal_spectrum(audio_signal,
+                                                    SAMPLE_RATE),
+            1e8),
+        'filter_bandpass_time': (
+            prepare_array,
+            lambda audio_signal: an.filter_bandpass(
+                audio_signal, sample_rate=SAMPLE_RATE, f_low=100,
+                f_high=10000),
+            1e8),
+        'filter_bandpass_freq': (
+            prepare_spectrum,
+            lambda amplitudes: an.filter_bandpass(
+                amplitudes, is_freq_domain=True, sample_rate=SAMPLE_RATE,
+                f_low=100, f_high=10000),
+            1e8),
+        'load_signal_wav': (
+            prepare_wav,
+            lambda filename: an.load_signal(filename, is_filtered=True,
+                                            filter_params=FILTER_PARAMS),
+            1e8),
+        'load_signal_wav_welch': (
+            prepare_wav,
+            lambda filename: an.load_signal(filename, spectrum_mode='welch'),
+            1e8),
+        'load_signal_txt': (
+            prepare_txt,
+            lambda filename: an.load_signal(filename, is_filtered=True,
+                                            filter_params=FILTER_PARAMS),
+            1e6),
+        'get_tl': (
+            prepare_wav,
+            lambda filename: an.get_tl(filename, None, channel_reference=-1,
+                                       is_plotted=False),
+            1e8),
+        'waveforms_sin': (
+            prepare_timestamps,
+            lambda timestamps: gr.waveforms(timestamps, {'freq': 1000},
+                                            signal_type='sin'),
+            1e8),
+        'waveforms_chirp': (
+            prepare_timestamps,
+            lambda timestamps: gr.waveforms(
+                timestamps, {'f_start': 20, 'f_end': 20000,
+                             'duration': timestamps[-1]},
+                signal_type='chirp'),
+            1e8),
+        'generate_and_record': (
+            prepare_recorder,
+            lambda wf_params: gr.generate_and_record(
+                wf_params, signal_type='chirp'),
+            1e7)
+    }
+
+
+# Cases which do not depend on the number of channels (load_signal analyzes
+# only the first channel of a wav file):
+SINGLE_CHANNEL_CASES = ['load_signal_wav', 'load_signal_wav_welch',
+                        'load_signal_txt', 'waveforms_sin', 'waveforms_chirp']
+
+
+# Filter designs, filter responses and band maps are cached for the latest
+# parameters; they are cleared before every run, so that the runs compute
+# them as the first call does:
+def clear_caches():
+    with an.response_tables_lock:
+        an.response_tables.clear()
+    an.butter_bandpass_sos.cache_clear()
+    an.resampling_plan.cache_clear()
+    with bd.band_maps_lock:
+        bd.band_maps.clear()
+
+
+def run_case(function, args, repeats):
+    wall_times = []
+    for _ in range(0, repeats):
+        clear_caches()
+        time_start = time.perf_counter()
+        function(*args)
+        wall_times.append(time.perf_counter() - time_start)
+
+    # Peak memory is measured in a separate run (tracing slows it down):
+    clear_caches()
+    tracemalloc.start()
+    function(*args)
+    [_, peak_memory] = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return min(wall_times), peak_memory
+
+
+def run_benchmarks(sizes, channel_counts, cases=None, repeats=3):
+    gr = import_recorder()
+    # Spectra and signals must be computed, not taken from the caches:
+    sc.default_cache = sc.SpectrumCache(path2cache=None, memory_limit=0)
+    ex.default_cache = ex.WaveformCache(memory_limit=0)
+
+    all_cases = benchmark_cases(gr)
+    cases = cases or list(all_cases.keys())
+    results = []
+
+    with tempfile.TemporaryDirectory() as path2tmp:
+        for case in cases:
+            [prepare, function, max_samples] = all_cases[case]
+            for samples in sizes:
+                if samples > max_samples:
+                    continue
+                for channels in channel_counts:
+                    if case in SINGLE_CHANNEL_CASES and channels > 1:
+                        continue
+                    if case == 'get_tl' and channels < 2:
+                        continue
+
+                    args = prepare(int(samples), channels, path2tmp)
+                    [wall_time, peak_memory] = \
+                        run_case(function, args, repeats)
+                    result = {
+                        'case': case,
+                        'samples': int(samples),
+                        'channels': channels,
+                        'wall_time': wall_time,
+                        'throughput': samples * channels / wall_time,
+                        'peak_memory': peak_memory
+                    }
+                    results.append(result)
+                    print("{case:24s} {samples:>11d} x {channels}: "
+                          "{wall_time:9.4f} s, {throughput:10.3e} samples/s, "
+                          "{peak:9.1f} MB".format(
+                              peak=peak_memory / 2 ** 20, **result))
+
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return None
+
+
+def compare_results(results, filename_baseline):
+    with open(filename_baseline) as file2read:
+        baseline = json.load(file2read)
+    baseline_results = {(result['case'], result['samples'],
+                         result['channels']): result
+                        for result in baseline['results']}
+
+    print("\nCompared with {} ({}):".format(filename_baseline,
+                                            baseline.get('commit')))
+    for result in results:
+        key = (result['case'], result['samples'], result['channels'])
+        if key not in baseline_results:
+            continue
+        old = baseline_results[key]
+        print("{:24s} {:>11d} x {}: time x{:.2f}, memory x{:.2f}".format(
+            *key, result['wall_time'] / old['wall_time'],
+            result['peak_memory'] / max(old['peak_memory'], 1)))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks of the analyzer and recorder.")
+    parser.add_argument('--sizes', nargs='+', type=float,
+                        default=[1e4, 1e5, 1e6, 1e7],
+                        help="signal lengths in samples (up to 1e8)")
+    parser.add_argument('--channels', nargs='+', type=int, default=[1, 2],
+                        help="channel counts")
+    parser.add_argument('--cases', nargs='+',
+                        help="cases to run (all by default)")
+    parser.add_argument('--repeats', type=int, default=3,
+                        help="timed runs per case (the best is kept)")
+    parser.add_argument('-o', '--output', default='benchmarks.json',
+                        help="file to save the results")
+    parser.add_argument('--compare',
+                        help="results of another run to compare with")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, args.channels, cases=args.cases,
+                             repeats=args.repeats)
+
+    with open(args.output, 'w') as file2save:
+        json.dump({
+            'commit': git_commit(),
+            'time': time.strftime("%Y-%m-%d-%H-%M-%S"),
+            'machine': platform.platform(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'results': results
+        }, file2save, indent=4)
+
+    if args.compare is not None:
+        compare_results(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+import weakref
+import numpy as np
+
+
+# Min/max decimation pyramid of a curve y(x) with monotonic x. Every level
+# keeps the minimum and the maximum of blocks of the previous level, so any
+# range of the curve can be drawn at screen resolution without losing peaks:
+class MinMaxPyramid:
+    def __init__(self, x, y, factor=4, min_size=2 ** 10):
+        self.x = np.asarray(x)
+        self.y = np.asarray(y, dtype=float)
+        self.factor = factor
+
+        # Levels: (block size, minima, maxima)
+        self.levels = []
+        y_min = self.y
+        y_max = self.y
+        block_size = 1
+        while len(y_min) > min_size:
+            y_min = np.fmin.reduce(pad_blocks(y_min, factor), axis=1)
+            y_max = np.fmax.reduce(pad_blocks(y_max, factor), axis=1)
+            block_size *= factor
+            self.levels.append((block_size, y_min, y_max))
+
+    # Points to draw the range [x_start, x_end] with at most max_points
+    # points:
+    def view(self, x_start, x_end, max_points):
+        idx_start = max(int(np.searchsorted(self.x, x_start)) - 1, 0)
+        idx_end = min(int(np.searchsorted(self.x, x_end)) + 1, len(self.x))
+        if idx_end - idx_start <= max_points:
+            return self.x[idx_start:idx_end], self.y[idx_start:idx_end]
+
+        # The finest level with few enough blocks:
+        for [block_size, y_min, y_max] in self.levels:
+            if (idx_end - idx_start) / block_size <= max_points / 2:
+                break
+
+        block_start = idx_start // block_size
+        block_end = -(-idx_end // block_size)
+        x_blocks = self.x[block_start * block_size:
+                          block_end * block_size:block_size]
+        x_view = np.repeat(x_blocks, 2)
+        y_view = np.column_stack((y_min[block_start:block_end],
+                                  y_max[block_start:block_end])).ravel()
+
+        return x_view, y_view
+
+
+# Reshape to [blocks, factor], the last block is padded with its last value:
+def pad_blocks(values, factor):
+    remainder = len(values) % factor
+    if remainder:
+        values = np.concatenate(
+            (values, np.full(factor - remainder, values[-1])))
+    return values.reshape(-1, factor)
+
+
+# Pyramids are built once per array (while the array exists):
+pyramids = {}
+
+
+def get_pyramid(x, y):
+    key = (id(x), id(y))
+    if key in pyramids:
+        [x_ref, y_ref, pyramid] = pyramids[key]
+        if x_ref() is x and y_ref() is y:
+            return pyramid
+
+    pyramid = MinMaxPyramid(x, y)
+    try:
+        pyramids[key] = (weakref.ref(x), weakref.ref(y), pyramid)
+    except TypeError:
+        # Not an array (e.g. a list), the pyramid is not kept
+        pass
+
+    # Remove the pyramids of the arrays which do not exist anymore:
+    for key_old in [key_old for key_old, [x_ref, y_ref, _] in pyramids.items()
+                    if x_ref() is None or y_ref() is None]:
+        del pyramids[key_old]
+
+    return pyramid
+
+
+# Line on matplotlib axes which shows the decimated curve and redraws only
+# the visible range at the resolution of the axes when the view changes:
+class LodLine:
+    def __init__(self, ax, x, y, *args, **kwargs):
+        self.ax = ax
+        self.pyramid = get_pyramid(x, y)
+        [x_view, y_view] = self.pyramid.view(-np.inf, np.inf,
+                                             self.max_points())
+        [self.line] = ax.plot(x_view, y_view, *args, **kwargs)
+        # A bound method would be kept as a weak reference only:
+        ax.callbacks.connect('xlim_changed', lambda ax: self.update(ax))
+
+    def max_points(self):
+        return max(2 * int(self.ax.bbox.width), 2 ** 10)
+
+    def update(self, ax):
+        [x_start, x_end] = sorted(ax.get_xlim())
+        self.line.set_data(*self.pyramid.view(x_start, x_end,
+                                              self.max_points()))
+        ax.figure.canvas.draw_idle()
@@ -0,0 +1,256 @@
+import json
+import threading
+from collections import OrderedDict
+import numpy as np
+from scipy.signal import chirp, max_len_seq
+
+# Import local modules:
+import analyzer as an
+
+# Excitation signals for the measurements. Every signal is synthesized for
+# the given number of samples and sample rate from the parameters of the
+# measurement (wf_params) and has the peak amplitude 1:
+#   sin        tone 'freq'
+#   chirp      linear sweep from 'f_start' to 'f_end'
+#   log_sweep  exponential sine sweep from 'f_start' to 'f_end' followed
+#              by 'silence' seconds without signal (for the decay of the
+#              response, see impulse_response)
+#   mls        maximum length sequence of order 'mls_order' (repeated)
+#   white_noise, pink_noise  noise with the seed 'seed'
+#   multisine  sum of the tones 'frequencies' (or 'tones' log-spaced tones
+#              from 'f_start' to 'f_end') with Schroeder phases
+# The synthesized buffers are cached (see WaveformCache), so the same signal
+# is computed once per process.
+
+WAVEFORM_PARAMS = {
+    'block_size': 2 ** 12,
+    'mls_order': 16,
+    'seed': 0,
+    'tones': 32,
+    'memory_limit': 256 * 2 ** 20
+}
+
+# Parameters of wf_params which define each signal type:
+SIGNAL_PARAMS = {
+    'sin': ['freq'],
+    'chirp': ['f_start', 'f_end', 'duration'],
+    'log_sweep': ['f_start', 'f_end', 'duration', 'silence'],
+    'mls': ['mls_order'],
+    'white_noise': ['seed'],
+    'pink_noise': ['seed'],
+    'multisine': ['frequencies', 'tones', 'f_start', 'f_end']
+}
+
+
+# Phase-continuous sine oscillator. A block of the complex rotation
+# exp(2j*pi*freq*n/sample_rate) is computed once and every block of the
+# output is this table rotated by the phasor of the block start, which is
+# cheaper than np.sin over the whole timeline. Consecutive calls of
+# generate() continue the phase:
+class Oscillator:
+    def __init__(self, freq, sample_rate, phase=0,
+                 block_size=WAVEFORM_PARAMS['block_size']):
+        self.freq = freq
+        self.sample_rate = sample_rate
+        self.phase = phase
+        self.block_size = block_size
+        self.position = 0
+        self.rotation = np.exp(2j * np.pi * freq / sample_rate *
+                               np.arange(block_size))
+
+    # The output is filled block by block, so only one block of the complex
+    # rotation is in memory besides the output itself:
+    def generate(self, samples, dtype='float64'):
+        signal = np.empty(samples, dtype=dtype)
+        omega = 2 * np.pi * self.freq / self.sample_rate
+        for block_start in range(0, samples, self.block_size):
+            block_end = min(block_start + self.block_size, samples)
+            # Phasor of the block start from the absolute position, so the
+            # phase error does not accumulate:
+            phasor = np.exp(1j * (omega * (self.position + block_start) +
+                                  self.phase))
+            signal[block_start:block_end] = \
+                (phasor * self.rotation[:block_end - block_start]).imag
+        self.position += samples
+        return signal
+
+    def reset(self):
+        self.position = 0
+
+
+def sine(samples, sample_rate, freq, dtype='float64'):
+    return Oscillator(freq, sample_rate).generate(samples, dtype=dtype)
+
+
+def sweep(samples, sample_rate, f_start, f_end, duration,
+          method='linear'):
+    timestamps = np.arange(samples) / sample_rate
+    return chirp(timestamps, f0=f_start, f1=f_end, t1=duration,
+                 method=method, phi=-90)
+
+
+# Maximum length sequence (values +-1) repeated up to the length:
+def mls(samples, order=WAVEFORM_PARAMS['mls_order']):
+    [sequence, _] = max_len_seq(order)
+    sequence = 2.0 * sequence - 1
+    return np.resize(sequence, samples)
+
+
+def white_noise(samples, seed=WAVEFORM_PARAMS['seed']):
+    signal = np.random.default_rng(seed).standard_normal(samples)
+    return normalize(signal)
+
+
+# Noise with the power spectral density 1/f:
+def pink_noise(samples, seed=WAVEFORM_PARAMS['seed']):
+    spectrum = np.fft.rfft(
+        np.random.default_rng(seed).standard_normal(samples))
+    scaling = np.arange(len(spectrum), dtype='float64')
+    scaling[0] = np.inf
+    signal = np.fft.irfft(spectrum / np.sqrt(scaling), n=samples)
+    return normalize(signal)
+
+
+# Sum of tones with Schroeder phases (low crest factor):
+def multisine(samples, sample_rate, frequencies):
+    tones = len(frequencies)
+    signal = np.zeros(samples)
+    for [idx, freq] in enumerate(frequencies):
+        phase = -np.pi * idx * (idx + 1) / tones
+        signal += Oscillator(freq, sample_rate, phase=phase).generate(samples)
+    return normalize(signal)
+
+
+def multisine_frequencies(wf_params):
+    if 'frequencies' in wf_params:
+        return list(wf_params['frequencies'])
+    tones = wf_params.get('tones', WAVEFORM_PARAMS['tones'])
+    return list(np.geomspace(wf_params['f_start'], wf_params['f_end'], tones))
+
+
+def normalize(signal):
+    peak = np.max(np.abs(signal))
+    return signal / peak if peak > 0 else signal
+
+
+def synthesize(signal_type, samples, sample_rate, wf_params,
+               dtype='float64'):
+    if signal_type == 'sin':
+        return sine(samples, sample_rate, wf_params['freq'], dtype=dtype)
+    elif signal_type == 'chirp':
+        signal = sweep(samples, sample_rate, wf_params['f_start'],
+                       wf_params['f_end'], wf_params['duration'])
+    elif signal_type == 'log_sweep':
+        sweep_duration = wf_params['duration'] - wf_params.get('silence', 0)
+        sweep_samples = min(samples, int(round(sweep_duration * sample_rate)))
+        signal = np.zeros(samples)
+        signal[:sweep_samples] = \
+            sweep(sweep_samples, sample_rate, wf_params['f_start'],
+                  wf_params['f_end'], sweep_duration, method='logarithmic')
+    elif signal_type == 'mls':
+        signal = mls(samples, order=wf_params.get(
+            'mls_order', WAVEFORM_PARAMS['mls_order']))
+    elif signal_type == 'white_noise':
+        signal = white_noise(
+            samples, seed=wf_params.get('seed', WAVEFORM_PARAMS['seed']))
+    elif signal_type == 'pink_noise':
+        signal = pink_noise(
+            samples, seed=wf_params.get('seed', WAVEFORM_PARAMS['seed']))
+    elif signal_type == 'multisine':
+        signal = multisine(samples, sample_rate,
+                           multisine_frequencies(wf_params))
+    else:
+        raise ValueError("Unknown signal type: {}".format(signal_type))
+    return signal.astype(dtype, copy=False)
+
+
+# LRU cache of synthesized signals in memory. The entries are evicted from
+# the least recently used one when the total size exceeds the limit:
+class WaveformCache:
+    def __init__(self, memory_limit=WAVEFORM_PARAMS['memory_limit']):
+        self.memory_limit = memory_limit
+        self.entries = OrderedDict()
+        self.memory_size = 0
+        self.lock = threading.Lock()
+
+    # Key of a signal: its type, length, sample rate, type of the samples
+    # and the parameters which define it:
+    @staticmethod
+    def key(signal_type, samples, sample_rate, wf_params, dtype='float64'):
+        params = {param: wf_params[param]
+                  for param in SIGNAL_PARAMS.get(signal_type, [])
+                  if param in wf_params}
+        return json.dumps([signal_type, samples, sample_rate,
+                           np.dtype(dtype).str, params],
+                          sort_keys=True, default=str)
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        return None
+
+    def put(self, key, signal):
+        # Cached signals are shared between the callers:
+        signal.flags.writeable = False
+        with self.lock:
+            if key in self.entries:
+                self.memory_size -= self.entries.pop(key).nbytes
+            if signal.nbytes > self.memory_limit:
+                return
+            self.entries[key] = signal
+            self.memory_size += signal.nbytes
+
+            while self.memory_size > self.memory_limit:
+                [_, entry] = self.entries.popitem(last=False)
+                self.memory_size -= entry.nbytes
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.memory_size = 0
+
+
+# Cache shared by the recorder:
+default_cache = None
+
+
+def get_cache():
+    global default_cache
+    if default_cache is None:
+        default_cache = WaveformCache()
+    return default_cache
+
+
+# Spectrum of a synthesized signal (frequencies and amplitudes, see
+# analyzer.signal_spectrum), kept in the cache with the signal:
+def waveform_spectrum(signal_type, samples, sample_rate, wf_params,
+                      dtype='float64'):
+    cache = get_cache()
+    key = cache.key(signal_type, samples, sample_rate, wf_params,
+                    dtype=dtype) + ' spectrum'
+    spectrum = cache.get(key)
+    if spectrum is None:
+        signal = waveform(signal_type, samples, sample_rate, wf_params,
+                          dtype=dtype)
+        spectrum = np.vstack(an.signal_spectrum(signal, sample_rate))
+        cache.put(key, spectrum)
+    return spectrum[0], spectrum[1]
+
+
+# Synthesized signal taken from the cache if possible (read-only):
+def waveform(signal_type, samples, sample_rate, wf_params, dtype='float64',
+             use_cache=True):
+    if not use_cache:
+        return synthesize(signal_type, samples, sample_rate, wf_params,
+                          dtype=dtype)
+
+    cache = get_cache()
+    key = cache.key(signal_type, samples, sample_rate, wf_params, dtype=dtype)
+    signal = cache.get(key)
+    if signal is None:
+        signal = synthesize(signal_type, samples, sample_rate, wf_params,
+                            dtype=dtype)
+        cache.put(key, signal)
+    return signal
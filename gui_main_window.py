@@ -14,14 +14,14 @@ from PyQt5 import QtCore, QtGui, QtWidgets
 class Ui_MainWindow(object):
     def setupUi(self, MainWindow):
         MainWindow.setObjectName("MainWindow")
-        MainWindow.resize(758, 595)
+        MainWindow.resize(758, 855)
         self.centralwidget = QtWidgets.QWidget(MainWindow)
         self.centralwidget.setObjectName("centralwidget")
         self.btnQuit = QtWidgets.QPushButton(self.centralwidget)
-        self.btnQuit.setGeometry(QtCore.QRect(300, 500, 118, 33))
+        self.btnQuit.setGeometry(QtCore.QRect(300, 760, 118, 33))
         self.btnQuit.setObjectName("btnQuit")
         self.tabWidget = QtWidgets.QTabWidget(self.centralwidget)
-        self.tabWidget.setGeometry(QtCore.QRect(0, 0, 751, 491))
+        self.tabWidget.setGeometry(QtCore.QRect(0, 0, 751, 751))
         self.tabWidget.setObjectName("tabWidget")
         self.tab_recording = QtWidgets.QWidget()
         self.tab_recording.setObjectName("tab_recording")
@@ -55,6 +55,12 @@ class Ui_MainWindow(object):
         self.comboBox_wfparam_type.addItem("")
         self.comboBox_wfparam_type.addItem("")
         self.comboBox_wfparam_type.addItem("")
+        self.comboBox_wfparam_type.addItem("")
+        self.comboBox_wfparam_type.addItem("")
+        self.comboBox_wfparam_type.addItem("")
+        self.comboBox_wfparam_type.addItem("")
+        self.comboBox_wfparam_type.addItem("")
+        self.comboBox_wfparam_type.addItem("")
         self.horizontalLayout_4.addWidget(self.comboBox_wfparam_type)
         self.verticalLayout_2.addLayout(self.horizontalLayout_4)
         self.verticalLayout_3.addLayout(self.verticalLayout_2)
@@ -138,6 +144,12 @@ class Ui_MainWindow(object):
         self.tabWidget.addTab(self.tab_recording, "")
         self.tab_analysis = QtWidgets.QWidget()
         self.tab_analysis.setObjectName("tab_analysis")
+        self.btnPlot_spectrogram = QtWidgets.QPushButton(self.tab_analysis)
+        self.btnPlot_spectrogram.setGeometry(QtCore.QRect(440, 150, 191, 41))
+        self.btnPlot_spectrogram.setObjectName("btnPlot_spectrogram")
+        self.plot_widget = SpectrumPlotWidget(self.tab_analysis)
+        self.plot_widget.setGeometry(QtCore.QRect(10, 320, 731, 390))
+        self.plot_widget.setObjectName("plot_widget")
         self.btnPlot_tl = QtWidgets.QPushButton(self.tab_analysis)
         self.btnPlot_tl.setGeometry(QtCore.QRect(440, 200, 191, 71))
         self.btnPlot_tl.setObjectName("btnPlot_tl")
@@ -280,6 +292,12 @@ class Ui_MainWindow(object):
         self.comboBox_wfparam_type.setItemText(0, _translate("MainWindow", "chirp"))
         self.comboBox_wfparam_type.setItemText(1, _translate("MainWindow", "sin"))
         self.comboBox_wfparam_type.setItemText(2, _translate("MainWindow", "sweep"))
+        self.comboBox_wfparam_type.setItemText(3, _translate("MainWindow", "log_sweep"))
+        self.comboBox_wfparam_type.setItemText(4, _translate("MainWindow", "multisine"))
+        self.comboBox_wfparam_type.setItemText(5, _translate("MainWindow", "white_noise"))
+        self.comboBox_wfparam_type.setItemText(6, _translate("MainWindow", "pink_noise"))
+        self.comboBox_wfparam_type.setItemText(7, _translate("MainWindow", "mls"))
+        self.comboBox_wfparam_type.setItemText(8, _translate("MainWindow", "impulse_response"))
         self.label_wfparam_freq_sin.setText(_translate("MainWindow", "Frequency, Hz"))
         self.lineEdit_wfparam_freq_sin.setText(_translate("MainWindow", "1500"))
         self.label_wfparam_freq_start.setText(_translate("MainWindow", "Freq. start, Hz"))
@@ -298,6 +316,8 @@ class Ui_MainWindow(object):
         self.label_wfparam_samplig.setText(_translate("MainWindow", "Sampling rate, Hz"))
         self.lineEdit_wfparam_sampling.setText(_translate("MainWindow", "44100"))
         self.tabWidget.setTabText(self.tabWidget.indexOf(self.tab_recording), _translate("MainWindow", "Recording"))
+        self.btnPlot_spectrogram.setStatusTip(_translate("MainWindow", "Plot a spectrogram of the recording"))
+        self.btnPlot_spectrogram.setText(_translate("MainWindow", "Plot spectrogram"))
         self.btnPlot_tl.setStatusTip(_translate("MainWindow", "Plot a transmission loss spectrum"))
         self.btnPlot_tl.setText(_translate("MainWindow", "Plot TL spectra"))
         self.label_tl_title.setText(_translate("MainWindow", "Plot transmission loss spectra"))
@@ -326,6 +346,8 @@ class Ui_MainWindow(object):
         self.actionPlot_signal.setText(_translate("MainWindow", "Plot signal spectra"))
         self.actionPlot_signal.setShortcut(_translate("MainWindow", "Ctrl+P"))
 
+from plot_widget import SpectrumPlotWidget
+
 
 if __name__ == "__main__":
     import sys
@@ -0,0 +1,126 @@
+import functools
+import numpy as np
+from scipy.signal import fftconvolve
+
+# Import local modules:
+import excitation as ex
+import analyzer as an
+
+# Impulse response measured with an exponential sine sweep (Farina). The
+# recording is convolved with the inverse filter of the sweep (the sweep
+# reversed in time with the amplitude decreasing by 6 dB per octave), which
+# gives the linear impulse response at the end of the sweep and the
+# responses of the harmonic distortion before it, delayed by
+# duration * ln(k) / ln(f_end / f_start) for the harmonic k.
+
+# Default parameters of the measurement (seconds):
+IR_PARAMS = {
+    'silence': 1,
+    'ir_length': 0.5,
+    'pre_delay': 1e-3,
+    'harmonics': 5
+}
+
+
+# Inverse filter of the sweep, normalized so that the sweep convolved with
+# it gives the unit amplitude in the sweep band. The array is shared
+# between the callers and must not be modified:
+@functools.lru_cache(maxsize=8)
+def inverse_filter(f_start, f_end, sweep_duration, sample_rate):
+    samples = int(round(sweep_duration * sample_rate))
+    sweep = ex.sweep(samples, sample_rate, f_start, f_end, sweep_duration,
+                     method='logarithmic')
+    timestamps = np.arange(samples) / sample_rate
+    envelope = np.exp(-timestamps * np.log(f_end / f_start) / sweep_duration)
+    inverse = sweep[::-1] * envelope
+
+    # Gain of the sweep convolved with the filter within the band:
+    len_fft = 2 ** int(np.ceil(np.log2(2 * samples)))
+    response = np.abs(np.fft.rfft(sweep, n=len_fft) *
+                      np.fft.rfft(inverse, n=len_fft))
+    frequencies = np.fft.rfftfreq(len_fft, 1 / sample_rate)
+    is_band = (frequencies >= f_start) & (frequencies <= f_end)
+    return inverse / np.mean(response[is_band])
+
+
+# Delays of the harmonics 1..harmonics relative to the linear response:
+def harmonic_delays(f_start, f_end, sweep_duration, harmonics):
+    return sweep_duration * np.log(np.arange(1, harmonics + 1)) / \
+        np.log(f_end / f_start)
+
+
+# Number of the harmonics (with the linear response) which can be
+# separated: the delay of the harmonic k is shorter than the sweep only for
+# k < f_end / f_start:
+def separable_harmonics(f_start, f_end, harmonics):
+    return int(max(1, min(harmonics, np.ceil(f_end / f_start) - 1)))
+
+
+# Convolution of the recording ([..., samples]) with the inverse filter.
+# The linear response starts at the index len(inverse) - 1:
+def deconvolve(signal_recorded, inverse):
+    inverse = np.reshape(inverse, (1,) * (np.ndim(signal_recorded) - 1) +
+                         (len(inverse),))
+    return fftconvolve(signal_recorded, inverse, axes=-1)
+
+
+# Linear impulse response ([..., ir_samples]) and the responses of the
+# harmonics 2..harmonics ([harmonics - 1, ..., harmonic_samples]). Every
+# response starts pre_delay seconds before its arrival; the responses of
+# the harmonics are cut before the next harmonic arrives. The harmonics
+# which arrive before the start of the deconvolved signal are dropped (see
+# separable_harmonics):
+def separate_harmonics(signal_deconvolved, sweep_samples, sample_rate,
+                       f_start, f_end, sweep_duration,
+                       harmonics=IR_PARAMS['harmonics'],
+                       ir_length=IR_PARAMS['ir_length'],
+                       pre_delay=IR_PARAMS['pre_delay']):
+    origin = sweep_samples - 1
+    pre_samples = int(round(pre_delay * sample_rate))
+    ir_samples = int(round(ir_length * sample_rate))
+    ir_samples = min(ir_samples,
+                     signal_deconvolved.shape[-1] - origin + pre_samples)
+    impulse_response = \
+        signal_deconvolved[..., origin - pre_samples:
+                           origin - pre_samples + ir_samples]
+
+    harmonics = separable_harmonics(f_start, f_end, harmonics)
+    delays = np.round(harmonic_delays(f_start, f_end, sweep_duration,
+                                      harmonics) * sample_rate).astype(int)
+    delays = delays[delays + pre_samples <= origin]
+    if len(delays) < 2:
+        return impulse_response, None
+    harmonic_samples = min(ir_samples, int(np.min(np.diff(delays))))
+    harmonic_responses = np.stack([
+        signal_deconvolved[..., origin - delay - pre_samples:
+                           origin - delay - pre_samples + harmonic_samples]
+        for delay in delays[1:]])
+
+    return impulse_response, harmonic_responses
+
+
+# Impulse responses of the recorded cycles [cycles, channels, samples]. The
+# cycles are averaged before the deconvolution (synchronous averaging):
+def measure_impulse_response(signal_recorded, wf_params):
+    sample_rate = wf_params['sample_rate']
+    sweep_duration = wf_params['duration'] - \
+        wf_params.get('silence', IR_PARAMS['silence'])
+    inverse = inverse_filter(wf_params['f_start'], wf_params['f_end'],
+                             sweep_duration, sample_rate)
+
+    signal_deconvolved = deconvolve(np.mean(signal_recorded, axis=0),
+                                    inverse)
+    return separate_harmonics(
+        signal_deconvolved, len(inverse), sample_rate,
+        wf_params['f_start'], wf_params['f_end'], sweep_duration,
+        harmonics=wf_params.get('harmonics', IR_PARAMS['harmonics']),
+        ir_length=wf_params.get('ir_length', IR_PARAMS['ir_length']),
+        pre_delay=wf_params.get('pre_delay', IR_PARAMS['pre_delay']))
+
+
+# Frequency response (amplitude and phase) of impulse responses
+# [..., samples]:
+def frequency_response(impulse_response, sample_rate):
+    [frequencies, response_fft] = \
+        an.signal_fft_positive(impulse_response, sample_rate)
+    return frequencies, np.abs(response_fft), np.angle(response_fft)
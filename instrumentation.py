@@ -0,0 +1,120 @@
+import sys
+import json
+import time
+import threading
+import contextlib
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+# Timing of the stages of a measurement session. The recorder reports
+# spans (waveform synthesis, playback/recording, FFT, averaging, pauses,
+# file writing, ...) and events (over/underruns) to the current profiler;
+# without an active profiler the calls cost almost nothing.
+
+
+class SessionProfiler:
+    def __init__(self, hook=None):
+        # hook is called with every finished span or event (live profiling)
+        self.hook = hook
+        self.time_start = time.monotonic()
+        self.spans = []
+        self.events = []
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, stage, **info):
+        span_start = time.monotonic()
+        try:
+            yield info
+        finally:
+            record = dict(info)
+            record['stage'] = stage
+            record['start'] = span_start - self.time_start
+            record['duration'] = time.monotonic() - span_start
+            with self.lock:
+                self.spans.append(record)
+            if self.hook is not None:
+                self.hook(record)
+
+    def event(self, name, **info):
+        record = dict(info)
+        record['event'] = name
+        record['time'] = time.monotonic() - self.time_start
+        with self.lock:
+            self.events.append(record)
+        if self.hook is not None:
+            self.hook(record)
+
+    # Total, mean and maximum duration per stage:
+    def summary(self):
+        stages = {}
+        for record in self.spans:
+            stage = stages.setdefault(record['stage'],
+                                      {'count': 0, 'total': 0, 'max': 0})
+            stage['count'] += 1
+            stage['total'] += record['duration']
+            stage['max'] = max(stage['max'], record['duration'])
+        for stage in stages.values():
+            stage['mean'] = stage['total'] / stage['count']
+        return stages
+
+    def save(self, filename):
+        with open(filename, 'w') as file2save:
+            json.dump({
+                'duration': time.monotonic() - self.time_start,
+                'peak_rss': peak_rss(),
+                'stages': self.summary(),
+                'spans': self.spans,
+                'events': self.events
+            }, file2save, indent=4, default=str)
+
+
+# Profiler which records nothing:
+class NullProfiler:
+    @contextlib.contextmanager
+    def span(self, stage, **info):
+        yield info
+
+    def event(self, name, **info):
+        pass
+
+
+null_profiler = NullProfiler()
+current = null_profiler
+
+
+def get_profiler():
+    return current
+
+
+# Make the profiler current for the duration of the block:
+@contextlib.contextmanager
+def profiling(profiler):
+    global current
+    previous = current
+    current = profiler
+    try:
+        yield profiler
+    finally:
+        current = previous
+
+
+def span(stage, **info):
+    return current.span(stage, **info)
+
+
+def event(name, **info):
+    current.event(name, **info)
+
+
+# Peak resident memory of the process in bytes:
+def peak_rss():
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS:
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
@@ -0,0 +1,149 @@
+import os
+import sys
+import json
+import argparse
+
+# Import local modules (no Qt, matplotlib is imported only for plots):
+import recorder as gr
+import sweep_journal as sj
+
+# Measurement plan (JSON or TOML):
+# {
+#     "output_dir": "recordings",
+#     "plot": false,
+#     "sessions": [
+#         {"type": "chirp", "duration": 5, "sample_rate": 44100,
+#          "cycles": 3, "cycles_pause": 1, "f_start": 20, "f_end": 20000},
+#         ...
+#     ]
+# }
+# Top-level keys other than output_dir and sessions are defaults for the
+# parameters of every session. A plan may also be a single set of
+# parameters.
+
+
+def load_plan(filename):
+    [_, filename_extension] = os.path.splitext(filename)
+    if filename_extension == '.toml':
+        try:
+            import tomllib
+        except ImportError:
+            import tomli as tomllib
+        with open(filename, 'rb') as file2read:
+            plan = tomllib.load(file2read)
+    else:
+        with open(filename) as file2read:
+            plan = json.load(file2read)
+
+    if 'sessions' not in plan:
+        plan = {'sessions': [plan]}
+    return plan
+
+
+# Parameters of every session of the plan (defaults from the top level):
+def plan_sessions(plan):
+    defaults = {key: value for key, value in plan.items()
+                if key not in ['output_dir', 'sessions']}
+    sessions = []
+    for session_params in plan['sessions']:
+        wf_params = dict(defaults)
+        wf_params.update(session_params)
+        sessions.append(wf_params)
+    return sessions
+
+
+def print_progress(info):
+    if info['stage'] == 'cycle':
+        print("Cycle {} from {} done".format(info['cycle'] + 1,
+                                             info['cycles']))
+
+
+# Live profiling: stages and events are printed as soon as they finish
+def print_profile(record):
+    if 'event' in record:
+        print("[profile] event {event} at {time:.3f} s".format(**record))
+    else:
+        print("[profile] {stage}: {duration:.3f} s".format(**record))
+
+
+# Run all sessions of a plan; returns the paths of the sessions:
+def run_plan(plan, dir_results=None, profile_hook=None):
+    if dir_results is None:
+        dir_results = plan.get('output_dir', 'recordings')
+
+    paths2save = []
+    sessions = plan_sessions(plan)
+    for [idx, wf_params] in enumerate(sessions):
+        path2save = gr.create_session(wf_params, dir_results=dir_results)
+        print("Session {} from {}: {}".format(idx + 1, len(sessions),
+                                              path2save))
+        try:
+            gr.gr_workflow(wf_params, path2save, progress=print_progress,
+                           profile_hook=profile_hook)
+        finally:
+            gr.close_session(path2save)
+        paths2save.append(path2save)
+
+    return paths2save
+
+
+# Resume an interrupted sweep session with the parameters saved in its
+# journal (the completed steps are not measured again):
+def resume_session(path2save, plot=None, profile_hook=None):
+    [header, _, _] = sj.read_journal(sj.journal_path(path2save))
+    wf_params = header['wf_params']
+    wf_params['resume'] = True
+    if plot is not None:
+        wf_params['plot'] = plot
+    try:
+        gr.gr_workflow(wf_params, path2save, progress=print_progress,
+                       profile_hook=profile_hook)
+    finally:
+        gr.close_session(path2save)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run generate/record sessions from a measurement plan "
+                    "without the GUI.")
+    parser.add_argument('plan', nargs='?',
+                        help="JSON or TOML file with the plan")
+    parser.add_argument('-o', '--output',
+                        help="directory for the sessions (overrides "
+                             "output_dir of the plan)")
+    parser.add_argument('--plot', action='store_true',
+                        help="save plots of the results")
+    parser.add_argument('--profile', action='store_true',
+                        help="print the timing of the stages live "
+                             "(profile.json is saved in any case)")
+    parser.add_argument('--resume', metavar='SESSION',
+                        help="resume the interrupted sweep of a session "
+                             "directory")
+    args = parser.parse_args()
+
+    profile_hook = print_profile if args.profile else None
+    if args.resume is not None:
+        try:
+            resume_session(args.resume, plot=True if args.plot else None,
+                           profile_hook=profile_hook)
+        except KeyboardInterrupt:
+            sys.exit("Measurement interrupted")
+        return
+    if args.plan is None:
+        parser.error("Give a plan or a session to --resume")
+
+    plan = load_plan(args.plan)
+    if args.plot:
+        plan['plot'] = True
+    else:
+        plan.setdefault('plot', False)
+
+    try:
+        run_plan(plan, dir_results=args.output,
+                 profile_hook=profile_hook)
+    except KeyboardInterrupt:
+        sys.exit("Measurement interrupted")
+
+
+if __name__ == '__main__':
+    main()
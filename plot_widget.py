@@ -0,0 +1,43 @@
+from PyQt5 import QtWidgets
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
+from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT
+
+# Import local modules:
+import analyzer as an
+import spectrogram as sg
+
+
+# Plot embedded in the window. The curves are decimated (see
+# decimation.LodLine), so spectra with millions of points can be panned
+# and zoomed interactively:
+class SpectrumPlotWidget(QtWidgets.QWidget):
+    def __init__(self, parent=None):
+        super(SpectrumPlotWidget, self).__init__(parent)
+        self.figure = Figure()
+        self.canvas = FigureCanvasQTAgg(self.figure)
+        self.toolbar = NavigationToolbar2QT(self.canvas, self)
+
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.toolbar)
+        layout.addWidget(self.canvas)
+
+    def plot_spectrum(self, frequencies, amplitudes, xlim=None):
+        self.figure.clear()
+        an.draw_spectrum(self.figure, frequencies, amplitudes, xlim=xlim)
+        self.figure.tight_layout()
+        self.canvas.draw_idle()
+
+    def plot_tl(self, frequencies, signal_amplitudes, reference_amplitudes,
+                transmission_loss, xlim=None):
+        self.figure.clear()
+        an.draw_tl(self.figure, frequencies, signal_amplitudes,
+                   reference_amplitudes, transmission_loss, xlim=xlim)
+        self.canvas.draw_idle()
+
+    def plot_spectrogram(self, spectrogram, times, frequencies):
+        self.figure.clear()
+        sg.draw_spectrogram(self.figure, spectrogram, times, frequencies)
+        self.figure.tight_layout()
+        self.canvas.draw_idle()
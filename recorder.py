@@ -1,156 +1,917 @@
+import os
 import time
+import datetime
+import threading
+import concurrent.futures
 import numpy as np
 import sounddevice as sd
-import matplotlib.pyplot as plt
-from scipy.io import wavfile
-from scipy.signal import chirp
 
 # Import local modules:
 import analyzer as an
+import excitation as ex
+import impulse_response as ir
+import wav_export as we
+import sweep_journal as sj
+import session_io as sio
+import instrumentation as ins
 
 
-# Prepare signals to generate
+# Raised when a measurement is cancelled (see the cancel event of the
+# workflows):
+class MeasurementCancelled(Exception):
+    pass
+
+
+# Pause which can be interrupted by the cancel event (the requested and
+# the actual duration are profiled):
+def pause(duration, cancel=None, stage='pause'):
+    with ins.span(stage, requested=duration):
+        duration = max(0, duration)
+        if cancel is None:
+            time.sleep(duration)
+        elif cancel.wait(duration):
+            raise MeasurementCancelled
+
+
+# Report the progress of a workflow (if a callback is given):
+def report(progress, **info):
+    if progress is not None:
+        progress(info)
+
+
+# Prepare signals to generate (see excitation for the signal types). The
+# signals are cached and read-only; with 'waveform_dtype': 'float32' in
+# wf_params they take half of the memory:
 def waveforms(timestamps, wf_params, signal_type='sin'):
-    if signal_type == 'sin':
-        signal_generated = np.sin(2 * np.pi * wf_params['freq'] * timestamps)
-    elif signal_type == 'chirp':
-        signal_generated = \
-            chirp(timestamps,
-                  f0=wf_params['f_start'], f1=wf_params['f_end'],
-                  t1=wf_params['duration'],
-                  method='linear', phi=-90)
+    if 'sample_rate' in wf_params:
+        sample_rate = wf_params['sample_rate']
     else:
-        signal_generated = []
+        sample_rate = 1 / (timestamps[1] - timestamps[0])
+
+    signal_generated = \
+        ex.waveform(signal_type, len(timestamps), sample_rate, wf_params,
+                    dtype=wf_params.get('waveform_dtype', 'float64'))
 
     return signal_generated
 
 
-# Simultaneously generate and record sound signals:
-def generate_and_record(wf_params, signal_type='sin'):
+# Simultaneously generate and record sound signals. All input channels
+# ('channels' in wf_params, 1 by default) are recorded in one pass; the
+# recordings have the shape [cycles, channels, samples].
+# With analysis=None the cycles are only recorded (the steps of a sweep
+# are analyzed by analyze_sweep_step).
+# The statistics over cycles (an.SpectrumAccumulator) are returned last;
+# with 'coherent_average' in wf_params the complex average is kept too.
+# The spectrum of a cycle is computed on a worker thread while the next
+# cycles are played and recorded (NumPy releases the GIL during the FFT).
+# progress is called after every cycle with a dict describing the state;
+# the measurement stops between cycles when the cancel event is set:
+# Every recorded cycle is passed to cycle_writer (see
+# wav_export.CycleWriter) as soon as it is recorded:
+def generate_and_record(wf_params, signal_type='sin', analysis='spectrum',
+                        progress=None, cancel=None, cycle_writer=None):
 
     # Define the time range:
     timestamps = \
         np.arange(wf_params['sample_rate'] * wf_params['duration']) / \
         wf_params['sample_rate']
+    channels = recorded_channels(wf_params)
 
     # Prepare signal form for generation:
-    signal_generated = waveforms(timestamps, wf_params, signal_type=signal_type)
-    signal_recorded = np.empty([wf_params['cycles'], len(timestamps)])
-
-    len_fft = 2 ** (int(np.ceil(np.log2(len(timestamps)))) - 1)
-    signal_amplitudes = np.empty([wf_params['cycles'], len_fft])
-    signal_frequencies = np.empty([wf_params['cycles'], len_fft])
-
-    for cycle in range(0, wf_params['cycles']):
-        # Record the signal until file is done playing:
-        recording = sd.playrec(signal_generated,
-                               samplerate=wf_params['sample_rate'],
-                               channels=1)
-        sd.wait()
-
-        signal_recorded[cycle, :] = np.array(recording[:, 0], dtype=float)
-
-        [signal_frequencies[cycle, :],
-         signal_amplitudes[cycle, :]] = \
-            an.signal_spectrum(signal_recorded[cycle, :],
-                               wf_params['sample_rate'])
-
-        time.sleep(wf_params['cycles_pause'])
-
-    # TODO: check that all frequency ranges are the same
-    signal_amplitudes_avg = np.mean(np.array(signal_amplitudes), axis=0)
-    signal_frequencies_avg = signal_frequencies[0, :]
+    with ins.span('synthesis'):
+        signal_generated = \
+            waveforms(timestamps, wf_params, signal_type=signal_type)
+    signal_recorded = \
+        np.empty([wf_params['cycles'], channels, len(timestamps)])
+
+    signal_statistics = an.SpectrumAccumulator(
+        is_coherent=wf_params.get('coherent_average', False))
+
+    # One worker, so the cycles are averaged in order:
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as worker:
+        cycles_analyzed = []
+        try:
+            record_cycles(wf_params, signal_generated, signal_recorded,
+                          signal_statistics, analysis, worker,
+                          cycles_analyzed, progress, cancel, cycle_writer)
+        finally:
+            if cancel is not None and cancel.is_set():
+                for cycle_analyzed in cycles_analyzed:
+                    cycle_analyzed.cancel()
+        # Cancelled during the last cycle (its analysis may be cancelled):
+        if cancel is not None and cancel.is_set():
+            raise MeasurementCancelled
+        with ins.span('analysis_join'):
+            for cycle_analyzed in cycles_analyzed:
+                cycle_analyzed.result()
+
+    # Frequencies are the same for all cycles and channels:
+    signal_frequencies_avg = signal_statistics.frequencies
+    signal_amplitudes_avg = signal_statistics.mean
 
     return \
         signal_frequencies_avg, signal_amplitudes_avg, timestamps, \
-        signal_recorded, signal_generated
-
+        signal_recorded, signal_generated, signal_statistics
 
-# Generate a sequence of sinusoidal signals
-def discrete_sin(wf_params, freq_array, path2save):
 
-    amplitudes_sweep = [None] * len(freq_array)
-    idx_freq = 0
+# Play and record the cycles; with analysis='spectrum' the spectrum of
+# every recorded cycle is submitted to the worker (the futures are appended
+# to cycles_analyzed):
+def record_cycles(wf_params, signal_generated, signal_recorded,
+                  signal_statistics, analysis, worker, cycles_analyzed,
+                  progress=None, cancel=None, cycle_writer=None):
+    channels = signal_recorded.shape[1]
 
-    with open('{}/amplitudes_sweep.txt'.format(path2save), 'w') as file2save:
-        file2save.write("Frequency (Hz), Amplitude\n\n")
-
-    for freq in freq_array:
-        # Generate and record the signal
-        wf_params['freq'] = freq
-        [signal_frequencies_avg, signal_amplitudes_avg, _, _, _] = \
-            generate_and_record(wf_params, signal_type='sin')
-
-        timing = time.time()
-
-        # Get amplitude at the given frequency
-        idx = (np.abs(signal_frequencies_avg - freq)).argmin()
-        amplitudes_sweep[idx_freq] = signal_amplitudes_avg[idx]
+    for cycle in range(0, wf_params['cycles']):
+        if cancel is not None and cancel.is_set():
+            raise MeasurementCancelled
+
+        with ins.span('cycle', cycle=cycle):
+            # Record the signal until file is done playing:
+            with ins.span('playrec'):
+                if wf_params.get('input_mapping') is not None:
+                    recording = sd.playrec(
+                        signal_generated,
+                        samplerate=wf_params['sample_rate'],
+                        input_mapping=wf_params['input_mapping'])
+                else:
+                    recording = sd.playrec(
+                        signal_generated,
+                        samplerate=wf_params['sample_rate'],
+                        channels=channels)
+                sd.wait()
+            report_stream_status(cycle)
+
+            signal_recorded[cycle, :, :] = recording.T
+            if cycle_writer is not None:
+                cycle_writer.write(cycle, signal_recorded[cycle, :, :])
+
+            # Spectra of all channels (one batched FFT):
+            if analysis == 'spectrum':
+                cycles_analyzed.append(worker.submit(
+                    analyze_cycles, signal_recorded[cycle:cycle + 1],
+                    wf_params, signal_statistics))
+
+        report(progress, stage='cycle', cycle=cycle,
+               cycles=wf_params['cycles'])
+        if cycle < wf_params['cycles'] - 1:
+            pause(wf_params['cycles_pause'], cancel, stage='cycles_pause')
+
+
+# Statistics over the recorded cycles [cycles, channels, samples]:
+def analyze_cycles(signal_recorded, wf_params, signal_statistics=None):
+    if signal_statistics is None:
+        signal_statistics = an.SpectrumAccumulator(
+            is_coherent=wf_params.get('coherent_average', False))
+
+    for cycle in range(0, signal_recorded.shape[0]):
+        with ins.span('fft'):
+            [signal_frequencies, signal_fft] = \
+                an.signal_fft_positive(signal_recorded[cycle, :, :],
+                                       wf_params['sample_rate'])
+        with ins.span('averaging'):
+            signal_statistics.update(signal_frequencies,
+                                     np.abs(signal_fft), signal_fft)
+
+    return signal_statistics
+
+
+# Number of the recorded channels ('input_mapping' or 'channels'):
+def recorded_channels(wf_params):
+    if wf_params.get('input_mapping') is not None:
+        return len(wf_params['input_mapping'])
+    return wf_params.get('channels', 1)
+
+
+# Profile the over/underruns of the last playrec:
+def report_stream_status(cycle):
+    if not hasattr(sd, 'get_status'):
+        return
+    status = sd.get_status()
+    if status:
+        ins.event('xrun', cycle=cycle, status=str(status))
+
+
+# Ring buffer between the audio callback and the writer thread. The
+# callback only copies the input block; if the writer falls behind by more
+# than the buffer length, the oldest samples are lost and counted:
+class RingBuffer:
+    def __init__(self, frames, channels, dtype='float32'):
+        self.data = np.zeros([frames, channels], dtype=dtype)
+        self.frames = frames
+        self.write_pos = 0
+        self.read_pos = 0
+        self.lost_frames = 0
+        self.data_ready = threading.Event()
+
+    def write(self, block):
+        start = self.write_pos % self.frames
+        block_frames = min(len(block), self.frames)
+        block = block[len(block) - block_frames:]
+        first = min(block_frames, self.frames - start)
+        self.data[start:start + first] = block[0:first]
+        self.data[0:block_frames - first] = block[first:]
+        self.write_pos += len(block)
+        self.data_ready.set()
+
+    # Copy of at most max_frames unread samples:
+    def read(self, max_frames):
+        available = self.write_pos - self.read_pos
+        if available > self.frames:
+            # Overrun: the unread samples were overwritten
+            self.lost_frames += available - self.frames
+            self.read_pos = self.write_pos - self.frames
+            available = self.frames
+
+        start = self.read_pos % self.frames
+        frames = min(available, max_frames, self.frames - start)
+        block = self.data[start:start + frames].copy()
+        self.read_pos += frames
+        return block
+
+    def wait(self, timeout=None):
+        self.data_ready.wait(timeout)
+        self.data_ready.clear()
+
+
+# Generate and record sound signals with a callback stream. The recorded
+# cycles are written to recorded_signal_{cycle}.wav by a writer thread as
+# the data arrives and the averaged spectrum is updated after every cycle,
+# so memory use does not depend on the number of cycles. With
+# 'stream_spectrum': 'welch' in wf_params the spectrum is accumulated block
+# by block and does not depend on the duration either:
+def generate_and_record_stream(wf_params, path2save, signal_type='sin',
+                               block_size=2 ** 12, buffer_duration=10,
+                               progress=None, cancel=None):
+    sample_rate = wf_params['sample_rate']
+    timestamps = \
+        np.arange(sample_rate * wf_params['duration']) / sample_rate
+    with ins.span('synthesis'):
+        signal_generated = \
+            waveforms(timestamps, wf_params, signal_type=signal_type)
 
-        # Save the result
-        with open('{}/amplitudes_sweep.txt'.format(path2save), 'a') as\
-                file2save:
-            file2save.write("{}, {}\n".format(freq, signal_amplitudes_avg[idx]))
+    input_mapping = wf_params.get('input_mapping')
+    if input_mapping is not None:
+        channels = len(input_mapping)
+        channels_device = max(input_mapping)
+        channels_selected = [channel - 1 for channel in input_mapping]
+    else:
+        channels = wf_params.get('channels', 1)
+        channels_device = channels
+        channels_selected = slice(None)
+
+    # Sequence of cycles with pauses (without the last pause):
+    samples = len(timestamps)
+    period = samples + int(round(wf_params['cycles_pause'] * sample_rate))
+    total = wf_params['cycles'] * period - (period - samples)
+
+    ring = RingBuffer(int(buffer_duration * sample_rate), channels)
+    stream_state = {'position': 0, 'xruns': 0, 'writer_error': None}
+    stream_finished = threading.Event()
+
+    def callback(indata, outdata, frames, time_info, status):
+        if status:
+            stream_state['xruns'] += 1
+        positions = stream_state['position'] + np.arange(frames)
+        positions_period = positions % period
+        is_active = (positions_period < samples) & (positions < total)
+
+        outdata.fill(0)
+        outdata[is_active, 0] = \
+            signal_generated[positions_period[is_active]]
+        ring.write(indata[is_active][:, channels_selected])
+
+        stream_state['position'] += frames
+        if stream_state['position'] >= total or \
+                stream_state['writer_error'] is not None or \
+                (cancel is not None and cancel.is_set()):
+            raise sd.CallbackStop
+
+    spectrum_mode = wf_params.get('stream_spectrum', 'fft')
+    signal_statistics = an.SpectrumAccumulator(
+        is_coherent=wf_params.get('coherent_average', False) and
+        spectrum_mode == 'fft')
+    filenames_recorded = \
+        ["{}/recorded_signal_{}.wav".format(path2save, cycle)
+         for cycle in range(0, wf_params['cycles'])]
+
+    profiler = ins.get_profiler()
+
+    # Errors of the writer (e.g. a full disk) stop the stream and are raised
+    # after the writer thread is joined:
+    def writer():
+        try:
+            write_cycles()
+        except Exception as error:
+            stream_state['writer_error'] = error
+
+    def write_cycles():
+        for cycle in range(0, wf_params['cycles']):
+            if spectrum_mode == 'welch':
+                accumulator = an.WelchAccumulator(sample_rate)
+
+            with open(filenames_recorded[cycle], 'wb') as file2save:
+                file2save.write(
+                    we.wav_header(sample_rate, channels, samples, 'float32'))
+                cycle_position = 0
+                while cycle_position < samples:
+                    block = ring.read(samples - cycle_position)
+                    if len(block) == 0:
+                        if stream_finished.is_set() and \
+                                ring.read_pos == ring.write_pos:
+                            if cancel is not None and cancel.is_set():
+                                break
+                            # The stream was stopped before the end
+                            block = np.zeros([samples - cycle_position,
+                                              channels], dtype='float32')
+                        else:
+                            ring.wait(timeout=0.1)
+                            continue
+                    file2save.write(block.astype('<f4').tobytes())
+                    if spectrum_mode == 'welch':
+                        accumulator.update(block.T)
+                    cycle_position += len(block)
+
+            # A cancelled measurement stops at the last recorded data (the
+            # incomplete cycle is removed):
+            if cycle_position < samples:
+                os.remove(filenames_recorded[cycle])
+                return
+
+            # Update the running spectrum with the finished cycle (the
+            # writer thread reports to the profiler of the caller):
+            with profiler.span('fft', cycle=cycle):
+                if spectrum_mode == 'welch':
+                    [frequencies, amplitudes] = accumulator.result()
+                else:
+                    recording = an.WavRecording(filenames_recorded[cycle])
+                    [frequencies, signal_fft] = an.signal_fft_positive(
+                        recording.to_float().reshape(samples, channels).T,
+                        sample_rate)
+                    amplitudes = np.abs(signal_fft)
+            with profiler.span('averaging', cycle=cycle):
+                if spectrum_mode == 'welch':
+                    signal_statistics.update(frequencies, amplitudes)
+                else:
+                    signal_statistics.update(frequencies, amplitudes,
+                                             signal_fft)
+            report(progress, stage='cycle', cycle=cycle,
+                   cycles=wf_params['cycles'])
+
+    writer_thread = threading.Thread(target=writer)
+    writer_thread.start()
+
+    with ins.span('stream', cycles=wf_params['cycles']):
+        with sd.Stream(samplerate=sample_rate, blocksize=block_size,
+                       channels=(channels_device, 1), dtype='float32',
+                       callback=callback,
+                       finished_callback=stream_finished.set):
+            stream_finished.wait()
+        ring.data_ready.set()
+        writer_thread.join()
+
+    if stream_state['writer_error'] is not None:
+        raise stream_state['writer_error']
+    if cancel is not None and cancel.is_set():
+        raise MeasurementCancelled
+
+    if ring.lost_frames > 0 or stream_state['xruns'] > 0:
+        ins.event('xrun', lost_frames=ring.lost_frames,
+                  xruns=stream_state['xruns'])
+        print("Warning: {} samples lost, {} stream over/underruns".format(
+            ring.lost_frames, stream_state['xruns']))
+
+    signal_frequencies_avg = signal_statistics.frequencies
+    signal_amplitudes_avg = signal_statistics.mean
 
-        # TODO: make the progress visible in the UI
+    return \
+        signal_frequencies_avg, signal_amplitudes_avg, timestamps, \
+        filenames_recorded, signal_generated, signal_statistics
+
+
+# Generate a sequence of sinusoidal signals. By default the amplitude is
+# extracted at the exact frequency of the tone ('sweep_method': 'tone');
+# 'fft' takes the nearest bin of the full spectrum instead.
+# The amplitudes of all cycles of every step are written to the sweep
+# journal (see sweep_journal); with 'resume' in wf_params the steps already
+# in the journal of path2save are not measured again. The amplitudes of
+# the steps which are not done (cancelled sweep) are NaN:
+def discrete_sin(wf_params, freq_array, path2save,
+                 progress=None, cancel=None):
+
+    sweep_method = wf_params.get('sweep_method', 'tone')
+    amplitudes_sweep = \
+        np.full([len(freq_array), recorded_channels(wf_params)], np.nan)
+
+    journal = sj.SweepJournal(sj.journal_path(path2save), freq_array,
+                              wf_params, resume=wf_params.get('resume', False))
+    for [idx_freq, [_, amplitudes_cycles]] in journal.steps.items():
+        amplitudes_sweep[idx_freq, :] = \
+            np.mean(amplitudes_cycles, axis=0)[:, 0]
+    if journal.steps:
+        print("Resumed: {} from {} samples are done\n".format(
+            len(journal.steps), len(freq_array)))
+
+    def collect():
+        # Results are taken (and journaled) in the order of the steps:
+        [idx_freq, freq, analysis_step] = steps_pending.pop(0)
+        amplitudes_cycles = analysis_step.result()
+        with ins.span('save', freq=freq):
+            journal.append(idx_freq, freq, amplitudes_cycles)
+        amplitudes_step = np.mean(amplitudes_cycles, axis=0)
+        amplitudes_sweep[idx_freq, :] = amplitudes_step[:, 0]
         print("Recorded: {} Hz.\nRemains: {} from {} samples\n".format(
             freq, len(freq_array) - idx_freq - 1, len(freq_array)))
-
-        exec_time = time.time() - timing
-        time.sleep(wf_params['sweep pause'] - exec_time)
-        idx_freq += 1
+        report(progress, stage='step', step=idx_freq,
+               steps=len(freq_array), freq=freq,
+               amplitudes=amplitudes_step)
+
+    # The analysis of a step runs in the background while the next steps
+    # are played:
+    scheduler = SweepScheduler(wf_params['sweep pause'])
+    steps_pending = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as worker:
+        try:
+            for [idx_freq, freq] in enumerate(freq_array):
+                if idx_freq in journal.steps:
+                    continue
+                scheduler.wait(cancel)
+
+                # Generate and record the signal
+                wf_params['freq'] = freq
+                with ins.span('sweep_step', freq=freq):
+                    [_, _, _, signal_recorded, _, _] = generate_and_record(
+                        wf_params, signal_type='sin', analysis=None,
+                        cancel=cancel)
+                scheduler.step_finished()
+
+                steps_pending.append((idx_freq, freq, worker.submit(
+                    analyze_sweep_step, signal_recorded, dict(wf_params),
+                    sweep_method)))
+                while steps_pending and steps_pending[0][2].done():
+                    collect()
+            while steps_pending:
+                collect()
+        finally:
+            # The steps recorded before an interruption are analyzed and
+            # journaled too (they are not measured again on resume):
+            for [idx_freq, freq, analysis_step] in steps_pending:
+                if analysis_step.exception() is None:
+                    journal.append(idx_freq, freq, analysis_step.result())
+            journal.close()
 
     return amplitudes_sweep
 
 
-# General workflow:
-def gr_workflow(wf_params, path2save):
-
-    if wf_params['type'] == 'sweep':
-        gr_workflow_sweep(wf_params, path2save)
+# Start times of the sweep steps on the monotonic clock: a step starts when
+# the pause after the end of the previous recording is over. The pause is
+# kept even if the analysis of the previous step is not done yet.
+class SweepScheduler:
+    def __init__(self, step_pause):
+        self.step_pause = step_pause
+        self.deadline = None
+
+    def wait(self, cancel=None):
+        if self.deadline is None:
+            return
+        pause(self.deadline - time.monotonic(), cancel, stage='sweep_pause')
+
+    def step_finished(self):
+        self.deadline = time.monotonic() + self.step_pause
+
+
+# Amplitudes of all cycles of a sweep step [cycles, channels, values] at
+# the frequency (and harmonics) of the tone or at the nearest bin of the
+# spectrum (one value):
+def analyze_sweep_step(signal_recorded, wf_params, sweep_method):
+    freq = wf_params['freq']
+    if sweep_method == 'tone':
+        with ins.span('tone'):
+            return an.tone_amplitudes(signal_recorded, freq,
+                                      wf_params['sample_rate'],
+                                      harmonics=wf_params.get('harmonics', 1))
+
+    with ins.span('fft'):
+        [signal_frequencies, signal_fft] = \
+            an.signal_fft_positive(signal_recorded, wf_params['sample_rate'])
+        idx = (np.abs(signal_frequencies - freq)).argmin()
+        return np.abs(signal_fft[..., idx:idx + 1])
+
+
+# Column names of the amplitudes in the sweep file:
+def sweep_header(channels, harmonics=1):
+    return ", ".join(sweep_columns(channels, harmonics))
+
+
+def sweep_columns(channels, harmonics=1):
+    if channels == 1 and harmonics == 1:
+        return ["Amplitude"]
+    columns = []
+    for channel in range(0, channels):
+        for harmonic in range(1, harmonics + 1):
+            column = "Amplitude"
+            if channels > 1:
+                column += " {}".format(channel)
+            if harmonics > 1:
+                column += " (harmonic {})".format(harmonic)
+            columns.append(column)
+    return columns
+
+
+# Create the directory of a new session (named by its start time) and save
+# the parameters:
+def create_session(wf_params, dir_results='recordings'):
+    current_datetime = datetime.datetime.now()
+    current_timestamp = current_datetime.strftime("%Y-%m-%d-%H-%M-%S")
+
+    path2save = '{}/{}'.format(dir_results, current_timestamp)
+    suffix = 1
+    while os.path.exists(path2save):
+        # Several sessions started within a second:
+        path2save = '{}/{}-{}'.format(dir_results, current_timestamp, suffix)
+        suffix += 1
+    os.makedirs(path2save)
+
+    # Save the parameters:
+    file_header = (
+        "Simultaneous generation and recording of sound signals. \n\n"
+        "Parameters of the generated signal: \n"
+    )
+    file_footer = (
+        "\n\n"
+        "All frequencies are given in Hz and all time measures"
+        " are in seconds. \n\n"
+        "Recording started at {} "
+    ).format(current_timestamp)
+
+    with open('{}/parameters.txt'.format(path2save), 'a') as \
+            file2save_param:
+        file2save_param.write(file_header)
+        for key, value in wf_params.items():
+            file2save_param.write("{}: {}\n".format(key, value))
+        file2save_param.write(file_footer)
+
+    return path2save
+
+
+# Save timestamp corresponding to the end of workflow:
+def close_session(path2save):
+    end_workflow_datetime = datetime.datetime.now()
+    end_workflow_timestamp = \
+        end_workflow_datetime.strftime("%Y-%m-%d-%H-%M-%S")
+    file_footer = (
+        "and ended at {}.\n"
+    ).format(end_workflow_timestamp)
+
+    with open('{}/parameters.txt'.format(path2save), 'a') as \
+            file2save_param:
+        file2save_param.write(file_footer)
+
+
+# General workflow (progress and cancel are passed to the measurement).
+# The timing of the stages is saved to profile.json of the session unless
+# wf_params['profile'] is False; profile_hook receives every stage record
+# as soon as it is finished:
+def gr_workflow(wf_params, path2save, progress=None, cancel=None,
+                profile_hook=None):
+    if not wf_params.get('profile', True):
+        profiler = ins.null_profiler
     else:
-        gr_workflow_wf(wf_params, path2save)
+        profiler = ins.SessionProfiler(hook=profile_hook)
+
+    try:
+        with ins.profiling(profiler):
+            if wf_params['type'] == 'sweep':
+                gr_workflow_sweep(wf_params, path2save,
+                                  progress=progress, cancel=cancel)
+            elif wf_params['type'] == 'impulse_response':
+                gr_workflow_ir(wf_params, path2save,
+                               progress=progress, cancel=cancel)
+            else:
+                gr_workflow_wf(wf_params, path2save,
+                               progress=progress, cancel=cancel)
+    finally:
+        # Saved also for cancelled or failed sessions:
+        if profiler is not ins.null_profiler:
+            profiler.save('{}/profile.json'.format(path2save))
 
 
 # Workflow for sin sweep:
-def gr_workflow_sweep(wf_params, path2save):
+def gr_workflow_sweep(wf_params, path2save, progress=None, cancel=None):
     freq_array = np.arange(wf_params['f_start'],
                            wf_params['f_end'] + 1, wf_params['f_step'])
-    amplitudes_sweep = discrete_sin(wf_params, freq_array, path2save)
-
-    plt.figure()
-    plt.plot(freq_array, amplitudes_sweep)
-    plt.plot(freq_array, amplitudes_sweep, 'r.')
-    plt.xlabel('Frequency (Hz)')
-    plt.ylabel('Amplitude')
+    try:
+        discrete_sin(wf_params, freq_array, path2save,
+                     progress=progress, cancel=cancel)
+    finally:
+        # Also for a cancelled or failed sweep (the completed steps):
+        save_sweep(wf_params, path2save)
+
+
+# The summary files and the plot of a sweep rebuilt from its journal (the
+# completed steps in the order of the frequencies). The text and the
+# binary files have the same columns:
+def save_sweep(wf_params, path2save):
+    if not os.path.isfile(sj.journal_path(path2save)):
+        return
+    with ins.span('save'):
+        [header, steps, _] = sj.read_journal(sj.journal_path(path2save))
+        if len(steps) == 0:
+            return
+        freq_array = np.array([header['frequencies'][step]
+                               for step in sorted(steps)])
+        # Averaged over cycles [steps, channels, values]:
+        amplitudes_steps = np.array([np.mean(steps[step][1], axis=0)
+                                     for step in sorted(steps)])
+        [channels, values] = amplitudes_steps.shape[1:]
+        amplitudes_sweep = amplitudes_steps[:, :, 0]
+
+        with open('{}/amplitudes_sweep.txt'.format(path2save), 'w') as \
+                file2save:
+            file2save.write("Frequency (Hz), {}\n\n".format(
+                sweep_header(channels, values)))
+            for [freq, amplitudes_step] in zip(freq_array, amplitudes_steps):
+                file2save.write("{}, {}\n".format(
+                    freq, ", ".join(str(amplitude) for amplitude in
+                                    amplitudes_step.ravel())))
+
+        if wf_params.get('output_format', 'binary') in ['binary', 'both']:
+            columns = {"Frequency (Hz)": freq_array}
+            for [idx, column] in \
+                    enumerate(sweep_columns(channels, values)):
+                columns[column] = \
+                    amplitudes_steps.reshape(len(freq_array), -1)[:, idx]
+            sio.save_columns('{}/amplitudes_sweep.npy'.format(path2save),
+                             columns, metadata={'wf_params': wf_params})
+
+    if wf_params.get('plot', True):
+        with ins.span('plot'):
+            plot_sweep(wf_params, freq_array, amplitudes_sweep, path2save)
+
+
+# Plot of the sweep result saved as a picture:
+def plot_sweep(wf_params, freq_array, amplitudes_sweep, path2save):
+    # Matplotlib is imported only when something is plotted. The figure is
+    # not bound to the GUI, so the workflow may run in a worker thread:
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.plot(freq_array, amplitudes_sweep)
+    ax.plot(freq_array, amplitudes_sweep, 'r.')
+    ax.set_xlabel('Frequency (Hz)')
+    ax.set_ylabel('Amplitude')
     if wf_params['f_end'] > wf_params['f_start']:
-        plt.xlim([wf_params['f_start'], wf_params['f_end']])
-    plt.savefig('{}/amplitudes_sweep.png'.format(path2save))
-
-
-def gr_workflow_wf(wf_params, path2save):
-    [signal_frequencies_avg, signal_amplitudes_avg, _,
-     signal_recorded, signal_generated] = \
-        generate_and_record(wf_params, signal_type=wf_params['type'])
-
-    # Save the generated signal as *.wav file:
-    wavfile.write("{}/generated_signal.wav".format(path2save),
-                  wf_params['sample_rate'], signal_generated)
-    [gen_freq, gen_amp] = \
-        an.signal_spectrum(signal_generated, wf_params['sample_rate'])
-    data2save = np.c_[gen_freq, gen_amp]
-    header = "Frequency (Hz), Amplitude"
-    np.savetxt("{}/signal_generated.txt".format(path2save), data2save,
-               header=header)
-
-    # Save the recorded signals
-    for cycle in range(0, wf_params['cycles']):
-        wavfile.write("{}/recorded_signal_{}.wav".format(path2save, cycle),
-                      wf_params['sample_rate'], signal_recorded[cycle, :])
-
-    # Save the averaged values
+        ax.set_xlim([wf_params['f_start'], wf_params['f_end']])
+    fig.savefig('{}/amplitudes_sweep.png'.format(path2save))
+
+
+# Sample format and layout of the exported cycles (see wav_export):
+def export_params(wf_params):
+    return {param: wf_params.get(param, value)
+            for [param, value] in we.EXPORT_PARAMS.items()}
+
+
+# Writer of the recorded cycles in the format and layout of the workflow:
+def get_cycle_writer(wf_params, path2save):
+    samples = int(np.ceil(wf_params['sample_rate'] * wf_params['duration']))
+    return we.CycleWriter(path2save, wf_params['sample_rate'],
+                          recorded_channels(wf_params), samples,
+                          wf_params['cycles'], **export_params(wf_params))
+
+
+# Save the generated signal as a wav file in the sample format of the
+# workflow (the recorded cycles are saved by the cycle writer):
+def save_signals(wf_params, path2save, signal_generated):
+    with ins.span('wav_write'):
+        generated_file = we.WavFile(
+            "{}/generated_signal.wav".format(path2save),
+            wf_params['sample_rate'], 1, len(signal_generated),
+            export_params(wf_params)['sample_format'])
+        generated_file.write(signal_generated[:, np.newaxis])
+        generated_file.close()
+
+
+# Workflow for the impulse response (exponential sine sweep, see
+# impulse_response). The impulse responses, the responses of the harmonic
+# distortion and the frequency responses are saved per channel; with
+# several channels the transmission loss of every channel relative to
+# 'reference_channel' (0 by default) is saved too:
+def gr_workflow_ir(wf_params, path2save, progress=None, cancel=None):
+    # The defaults are filled in a copy (the caller's parameters are kept):
+    wf_params = dict(wf_params)
+    for [param, value] in ir.IR_PARAMS.items():
+        wf_params.setdefault(param, value)
+    if wf_params['silence'] >= wf_params['duration']:
+        raise ValueError("The silence after the sweep must be shorter "
+                         "than the duration")
+    if wf_params['f_end'] <= wf_params['f_start']:
+        raise ValueError("The sweep must end at a higher frequency")
+    harmonics = ir.separable_harmonics(wf_params['f_start'],
+                                       wf_params['f_end'],
+                                       wf_params['harmonics'])
+    if harmonics < wf_params['harmonics']:
+        print("Warning: only {} harmonics can be separated for the sweep "
+              "{}-{} Hz".format(harmonics, wf_params['f_start'],
+                                wf_params['f_end']))
+        wf_params['harmonics'] = harmonics
+
+    cycle_writer = get_cycle_writer(wf_params, path2save)
+    try:
+        [_, _, _, signal_recorded, signal_generated, _] = \
+            generate_and_record(wf_params, signal_type='log_sweep',
+                                analysis=None, progress=progress,
+                                cancel=cancel, cycle_writer=cycle_writer)
+    finally:
+        with ins.span('wav_write'):
+            cycle_writer.close()
+    files_recorded = cycle_writer.filenames
+    save_signals(wf_params, path2save, signal_generated)
+
+    with ins.span('deconvolution'):
+        [impulse_response, harmonic_responses] = \
+            ir.measure_impulse_response(signal_recorded, wf_params)
+    with ins.span('fft'):
+        [frequencies, amplitudes, phases] = \
+            ir.frequency_response(impulse_response, wf_params['sample_rate'])
+        if harmonic_responses is not None:
+            # Zero-padded to the length of the linear response, so all
+            # responses have the same frequencies:
+            harmonic_padded = np.zeros(harmonic_responses.shape[:-1] +
+                                       impulse_response.shape[-1:])
+            harmonic_padded[..., :harmonic_responses.shape[-1]] = \
+                harmonic_responses
+            [_, harmonic_amplitudes, _] = ir.frequency_response(
+                harmonic_padded, wf_params['sample_rate'])
+
+    channels = impulse_response.shape[0]
+    reference_channel = wf_params.get('reference_channel', 0)
+    files = {'impulse_response': [], 'harmonic_responses': [],
+             'frequency_response': [], 'transmission_loss': []}
+    for channel in range(0, channels):
+        suffix = "" if channels == 1 else "_{}".format(channel)
+
+        columns = {
+            "Time (s)": (np.arange(impulse_response.shape[-1]) /
+                         wf_params['sample_rate'] - wf_params['pre_delay']),
+            "Impulse response": impulse_response[channel]
+        }
+        files['impulse_response'].append("impulse_response" + suffix)
+        with ins.span('save', channel=channel):
+            sio.save_result("{}/impulse_response{}".format(path2save, suffix),
+                            columns, wf_params)
+
+        columns = {
+            "Frequency (Hz)": frequencies,
+            "Amplitude": amplitudes[channel],
+            "Phase (rad)": phases[channel]
+        }
+        if harmonic_responses is not None:
+            for harmonic in range(2, len(harmonic_responses) + 2):
+                columns["Harmonic {}".format(harmonic)] = \
+                    harmonic_amplitudes[harmonic - 2, channel]
+
+            files['harmonic_responses'].append("harmonic_responses" + suffix)
+            columns_harmonics = {
+                "Time (s)": (np.arange(harmonic_responses.shape[-1]) /
+                             wf_params['sample_rate'] -
+                             wf_params['pre_delay'])
+            }
+            for harmonic in range(2, len(harmonic_responses) + 2):
+                columns_harmonics["Harmonic {}".format(harmonic)] = \
+                    harmonic_responses[harmonic - 2, channel]
+            with ins.span('save', channel=channel):
+                sio.save_result(
+                    "{}/harmonic_responses{}".format(path2save, suffix),
+                    columns_harmonics, wf_params)
+
+        files['frequency_response'].append("frequency_response" + suffix)
+        with ins.span('save', channel=channel):
+            sio.save_result(
+                "{}/frequency_response{}".format(path2save, suffix),
+                columns, wf_params)
+
+        if channels > 1 and channel != reference_channel:
+            transmission_loss = 20 * np.log10(
+                np.divide(amplitudes[channel], amplitudes[reference_channel]))
+            files['transmission_loss'].append("transmission_loss" + suffix)
+            with ins.span('save', channel=channel):
+                sio.save_result(
+                    "{}/transmission_loss{}".format(path2save, suffix),
+                    {"Frequency (Hz)": frequencies,
+                     "Transmission loss": transmission_loss}, wf_params)
+
+    files['generated'] = "generated_signal.wav"
+    files['recorded'] = files_recorded
+    files.update(export_params(wf_params))
+    sio.save_session(path2save, wf_params, files)
+
+    if wf_params.get('plot', True):
+        with ins.span('plot'):
+            plot_ir(wf_params, impulse_response, frequencies, amplitudes,
+                    path2save)
+
+
+# Plot of the impulse and frequency responses saved as a picture:
+def plot_ir(wf_params, impulse_response, frequencies, amplitudes,
+            path2save):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax_ir = fig.add_subplot(211)
+    ax_ir.plot(np.arange(impulse_response.shape[-1]) /
+               wf_params['sample_rate'] - wf_params['pre_delay'],
+               impulse_response.T)
+    ax_ir.set_xlabel('Time (s)')
+    ax_ir.set_ylabel('Impulse response')
+
+    ax_fr = fig.add_subplot(212)
+    ax_fr.semilogx(frequencies[1:], 20 * np.log10(amplitudes[:, 1:].T))
+    ax_fr.set_xlim([wf_params['f_start'], wf_params['f_end']])
+    ax_fr.set_xlabel('Frequency (Hz)')
+    ax_fr.set_ylabel('Amplitude (dB)')
+
+    fig.tight_layout()
+    fig.savefig('{}/impulse_response.png'.format(path2save))
+
+
+def gr_workflow_wf(wf_params, path2save, progress=None, cancel=None):
+    if wf_params.get('streaming', False):
+        # The recorded cycles are saved during the recording (float32, one
+        # file per cycle):
+        [signal_frequencies_avg, signal_amplitudes_avg, _,
+         _, signal_generated, signal_statistics] = \
+            generate_and_record_stream(wf_params, path2save,
+                                       signal_type=wf_params['type'],
+                                       progress=progress, cancel=cancel)
+        files_recorded = ["recorded_signal_{}.wav".format(cycle)
+                          for cycle in range(0, wf_params['cycles'])]
+        export = {'sample_format': 'float32', 'cycles_layout': 'files'}
+    else:
+        # Every cycle is written by the background writer as soon as it is
+        # recorded:
+        cycle_writer = get_cycle_writer(wf_params, path2save)
+        try:
+            [signal_frequencies_avg, signal_amplitudes_avg, _,
+             _, signal_generated, signal_statistics] = \
+                generate_and_record(wf_params, signal_type=wf_params['type'],
+                                    progress=progress, cancel=cancel,
+                                    cycle_writer=cycle_writer)
+        finally:
+            with ins.span('wav_write'):
+                cycle_writer.close()
+        files_recorded = cycle_writer.filenames
+        export = export_params(wf_params)
+
+    save_signals(wf_params, path2save, signal_generated)
+    # The spectrum of the generated signal is cached with its waveform:
+    with ins.span('fft'):
+        [gen_freq, gen_amp] = ex.waveform_spectrum(
+            wf_params['type'], len(signal_generated),
+            wf_params['sample_rate'], wf_params,
+            dtype=wf_params.get('waveform_dtype', 'float64'))
+    with ins.span('save'):
+        sio.save_result("{}/signal_generated".format(path2save),
+                        {"Frequency (Hz)": gen_freq, "Amplitude": gen_amp},
+                        wf_params)
+
+    # Save the averaged values with their uncertainty (per channel):
     # TODO: add info about the recording
-    data2save = np.c_[signal_frequencies_avg, signal_amplitudes_avg]
-    header = "Frequency (Hz), Amplitude"
-    np.savetxt("{}/signal_recorded_avg.txt".format(path2save), data2save,
-               header=header)
+    channels = signal_amplitudes_avg.shape[0]
+    amplitudes_std = signal_statistics.std()
+    [amplitudes_ci_low, amplitudes_ci_high] = \
+        signal_statistics.confidence_interval()
+    amplitudes_coherent = signal_statistics.coherent_amplitudes()
+    confidence = 100 * signal_statistics.confidence
+    files_avg = []
+    for channel in range(0, channels):
+        columns = {
+            "Frequency (Hz)": signal_frequencies_avg,
+            "Amplitude": signal_amplitudes_avg[channel, :],
+            "Standard deviation": amplitudes_std[channel, :],
+            "CI {:g}% low".format(confidence):
+                amplitudes_ci_low[channel, :],
+            "CI {:g}% high".format(confidence):
+                amplitudes_ci_high[channel, :]
+        }
+        if amplitudes_coherent is not None:
+            columns["Coherent amplitude"] = amplitudes_coherent[channel, :]
+        if channels == 1:
+            files_avg.append("signal_recorded_avg")
+        else:
+            files_avg.append("signal_recorded_avg_{}".format(channel))
+        with ins.span('save', channel=channel):
+            sio.save_result("{}/{}".format(path2save, files_avg[channel]),
+                            columns, wf_params)
+
+    sio.save_session(path2save, wf_params, {
+        'generated': "generated_signal.wav",
+        'recorded': files_recorded,
+        'averaged': files_avg,
+        'cycles': signal_statistics.count,
+        **export
+    })
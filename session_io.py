@@ -0,0 +1,73 @@
+import os
+import json
+import numpy as np
+
+# Binary container for spectra and session results: the columns (frequency,
+# amplitude, ...) are stored as the rows of one .npy array, which can be
+# memory-mapped, and a .json sidecar with the same name keeps the column
+# names and the metadata (e.g. wf_params).
+
+
+def sidecar_path(filename):
+    return '{}.json'.format(os.path.splitext(filename)[0])
+
+
+# Save columns of equal length (column names are the keys of the dict):
+def save_columns(filename, columns, metadata=None):
+    data = np.vstack([np.asarray(values, dtype=float)
+                      for values in columns.values()])
+    np.save(filename, data)
+
+    with open(sidecar_path(filename), 'w') as file2save:
+        json.dump({'columns': list(columns.keys()),
+                   'shape': list(data.shape),
+                   'metadata': metadata or {}},
+                  file2save, indent=4, default=json_default)
+
+
+# Load the container; the data is memory-mapped by default:
+def load_columns(filename, mmap_mode='r'):
+    data = np.load(filename, mmap_mode=mmap_mode)
+
+    path2sidecar = sidecar_path(filename)
+    if os.path.isfile(path2sidecar):
+        with open(path2sidecar) as file2read:
+            sidecar = json.load(file2read)
+    else:
+        sidecar = {'columns': ['Frequency (Hz)', 'Amplitude'],
+                   'metadata': {}}
+
+    return data, sidecar
+
+
+# Save columns as text (the former output format):
+def save_columns_text(filename, columns):
+    data2save = np.column_stack([values for values in columns.values()])
+    np.savetxt(filename, data2save, header=", ".join(columns.keys()))
+
+
+# Save columns in the formats selected with 'output_format' in wf_params
+# ('binary' by default, 'text' or 'both'). path2file has no extension:
+def save_result(path2file, columns, wf_params):
+    output_format = wf_params.get('output_format', 'binary')
+    if output_format in ['binary', 'both']:
+        save_columns('{}.npy'.format(path2file), columns,
+                     metadata={'wf_params': wf_params})
+    if output_format in ['text', 'both']:
+        save_columns_text('{}.txt'.format(path2file), columns)
+
+
+# Save the parameters and the list of files of a session:
+def save_session(path2save, wf_params, files):
+    with open('{}/session.json'.format(path2save), 'w') as file2save:
+        json.dump({'wf_params': wf_params, 'files': files},
+                  file2save, indent=4, default=json_default)
+
+
+# NumPy values are not JSON serializable:
+def json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return str(value)
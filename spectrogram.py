@@ -0,0 +1,291 @@
+import os
+import json
+import argparse
+import numpy as np
+from scipy import signal
+
+# Import local modules:
+import analyzer as an
+import spectrum_cache as sc
+
+# Short-time Fourier transform (spectrogram) of wav files of any length. The
+# recording is read in blocks, the overlapping windowed segments of a block
+# are transformed at once and the magnitudes (frames x bins, float32) are
+# written to a memory-mapped .npy file with a .json sidecar. Memory does not
+# depend on the length of the recording (see 'memory_limit').
+
+STFT_PARAMS = {
+    'segment_length': 2 ** 12,
+    'overlap': 0.75,
+    'window': 'hann',
+    'memory_limit': 64 * 2 ** 20
+}
+
+# Spectrograms computed for the plots are kept next to the spectrum cache
+# (the least recently used are removed):
+SPECTROGRAM_CACHE = {
+    'path': os.path.join(os.path.dirname(sc.CACHE_PARAMS['path']),
+                         'spectrograms'),
+    'entries': 8
+}
+
+
+def stft_wav(filename, path2save=None, channel=0, stft_params=None,
+             is_filtered=False, filter_params=None):
+    params = dict(STFT_PARAMS)
+    if stft_params is not None:
+        params.update(stft_params)
+    segment_length = params['segment_length']
+    hop = max(1, int(round(segment_length * (1 - params['overlap']))))
+    window = signal.get_window(params['window'], segment_length)
+
+    recording = an.WavRecording(filename)
+    frames = 0 if recording.samples < segment_length else \
+        1 + (recording.samples - segment_length) // hop
+    bins = segment_length // 2 + 1
+
+    # Frames per block: the segments, their spectra and the magnitudes
+    # within the memory limit:
+    batch_frames = max(1, params['memory_limit'] //
+                       (segment_length * 8 + bins * 20))
+
+    if path2save is None:
+        spectrogram = np.empty([frames, bins], dtype='float32')
+    else:
+        spectrogram = np.lib.format.open_memmap(
+            path2save, mode='w+', dtype='float32', shape=(frames, bins))
+
+    signal_blocks = recording.blocks(block_size=batch_frames * hop,
+                                     channel=channel)
+    if is_filtered:
+        signal_blocks = \
+            an.filter_blocks(signal_blocks,
+                             f_low=filter_params['f_low'],
+                             f_high=filter_params['f_high'],
+                             order=filter_params['order'],
+                             sample_rate=recording.sample_rate)
+
+    # Samples of the segments which are not complete yet are kept in tail:
+    tail = np.empty(0)
+    frame = 0
+    for block in signal_blocks:
+        samples = np.concatenate((tail, block))
+        if len(samples) < segment_length:
+            tail = samples
+            continue
+        block_frames = min(1 + (len(samples) - segment_length) // hop,
+                           frames - frame)
+        segments = np.lib.stride_tricks.sliding_window_view(
+            samples, segment_length)[::hop][:block_frames]
+        spectrogram[frame:frame + block_frames] = \
+            np.abs(np.fft.rfft(segments * window, axis=-1))
+        frame += block_frames
+        tail = samples[block_frames * hop:]
+
+    if path2save is not None:
+        spectrogram.flush()
+        with open(sidecar_path(path2save), 'w') as file2save:
+            json.dump({
+                'filename': filename,
+                'channel': channel,
+                'sample_rate': recording.sample_rate,
+                'segment_length': segment_length,
+                'hop': hop,
+                'window': params['window'],
+                'shape': [frames, bins],
+                'filter_params': filter_params if is_filtered else None
+            }, file2save, indent=4, default=str)
+
+    return spectrogram, \
+        stft_times(frames, hop, segment_length, recording.sample_rate), \
+        np.fft.rfftfreq(segment_length, 1 / recording.sample_rate)
+
+
+# Centers of the frames in seconds:
+def stft_times(frames, hop, segment_length, sample_rate):
+    return (np.arange(frames) * hop + segment_length / 2) / sample_rate
+
+
+def sidecar_path(filename):
+    return '{}.json'.format(os.path.splitext(filename)[0])
+
+
+# Memory-mapped spectrogram with its times and frequencies:
+def load_spectrogram(filename):
+    spectrogram = np.load(filename, mmap_mode='r')
+    with open(sidecar_path(filename)) as file2read:
+        sidecar = json.load(file2read)
+    times = stft_times(spectrogram.shape[0], sidecar['hop'],
+                       sidecar['segment_length'], sidecar['sample_rate'])
+    frequencies = np.fft.rfftfreq(sidecar['segment_length'],
+                                  1 / sidecar['sample_rate'])
+    return spectrogram, times, frequencies
+
+
+# Spectrogram of a recording taken from the cache directory if it was
+# computed before with the same parameters:
+def get_spectrogram(filename, channel=0, stft_params=None,
+                    is_filtered=False, filter_params=None,
+                    path2cache=SPECTROGRAM_CACHE['path']):
+    key = sc.SpectrumCache.key(
+        filename, channel=channel, stft_params=stft_params,
+        filter_params=filter_params if is_filtered else None)
+    path2entry = os.path.join(path2cache, '{}.npy'.format(key))
+
+    if os.path.isfile(path2entry) and \
+            os.path.isfile(sidecar_path(path2entry)):
+        os.utime(path2entry)
+        return load_spectrogram(path2entry)
+
+    os.makedirs(path2cache, exist_ok=True)
+    stft_wav(filename, path2save=path2entry, channel=channel,
+             stft_params=stft_params, is_filtered=is_filtered,
+             filter_params=filter_params)
+    evict_spectrograms(path2cache)
+    return load_spectrogram(path2entry)
+
+
+def evict_spectrograms(path2cache, entries=SPECTROGRAM_CACHE['entries']):
+    spectrograms = sorted(
+        (entry.stat().st_mtime, entry.path)
+        for entry in os.scandir(path2cache) if entry.name.endswith('.npy'))
+    for [_, path2entry] in spectrograms[:-entries]:
+        for path2remove in [path2entry, sidecar_path(path2entry)]:
+            try:
+                os.remove(path2remove)
+            except FileNotFoundError:
+                pass
+
+
+# Decimated view of a time and frequency range for display: the maxima of
+# blocks of frames and bins (peaks are kept), at most max_frames x max_bins.
+# The frames are read in chunks, so the whole range is never in memory:
+def spectrogram_view(spectrogram, times, frequencies, t_range=None,
+                     f_range=None, max_frames=1024, max_bins=1024,
+                     chunk_frames=2 ** 12):
+    [frame_start, frame_end] = range_indices(times, t_range)
+    [bin_start, bin_end] = range_indices(frequencies, f_range)
+    if frame_end <= frame_start or bin_end <= bin_start:
+        return times[0:0], frequencies[0:0], np.empty([0, 0], 'float32')
+
+    frames_step = -(-(frame_end - frame_start) // max_frames)
+    bins_step = -(-(bin_end - bin_start) // max_bins)
+    bins_idx = np.arange(0, bin_end - bin_start, bins_step)
+    chunk = frames_step * max(1, chunk_frames // frames_step)
+
+    view = []
+    for chunk_start in range(frame_start, frame_end, chunk):
+        block = np.asarray(spectrogram[chunk_start:
+                                       min(chunk_start + chunk, frame_end),
+                                       bin_start:bin_end])
+        block = np.maximum.reduceat(
+            block, np.arange(0, len(block), frames_step), axis=0)
+        view.append(np.maximum.reduceat(block, bins_idx, axis=1))
+
+    return times[frame_start:frame_end:frames_step], \
+        frequencies[bin_start + bins_idx], np.concatenate(view)
+
+
+# Indices of the values within [start, end] (all values without a range):
+def range_indices(values, value_range=None):
+    if value_range is None:
+        return 0, len(values)
+    [value_start, value_end] = sorted(value_range)
+    return max(int(np.searchsorted(values, value_start)) - 1, 0), \
+        min(int(np.searchsorted(values, value_end)) + 1, len(values))
+
+
+# Spectrogram (in dB) on matplotlib axes which is redrawn at the resolution
+# of the axes for the visible range when the view changes:
+class SpectrogramImage:
+    def __init__(self, ax, spectrogram, times, frequencies, **kwargs):
+        self.ax = ax
+        self.spectrogram = spectrogram
+        self.times = times
+        self.frequencies = frequencies
+        [times_view, frequencies_view, values] = self.view()
+        self.image = ax.imshow(
+            self.to_db(values).T, origin='lower', aspect='auto',
+            extent=self.extent(times_view, frequencies_view),
+            interpolation='nearest', **kwargs)
+        ax.set_xlim(times[0], times[-1])
+        ax.set_ylim(frequencies[0], frequencies[-1])
+        # A bound method would be kept as a weak reference only:
+        ax.callbacks.connect('xlim_changed', lambda ax: self.update(ax))
+        ax.callbacks.connect('ylim_changed', lambda ax: self.update(ax))
+
+    def view(self, t_range=None, f_range=None):
+        bbox = self.ax.bbox
+        return spectrogram_view(
+            self.spectrogram, self.times, self.frequencies,
+            t_range=t_range, f_range=f_range,
+            max_frames=max(int(bbox.width), 2 ** 8),
+            max_bins=max(int(bbox.height), 2 ** 8))
+
+    @staticmethod
+    def to_db(values):
+        return 20 * np.log10(np.maximum(values, np.finfo('float32').tiny))
+
+    @staticmethod
+    def extent(times_view, frequencies_view):
+        return [times_view[0], times_view[-1],
+                frequencies_view[0], frequencies_view[-1]]
+
+    def update(self, ax):
+        [times_view, frequencies_view, values] = \
+            self.view(ax.get_xlim(), ax.get_ylim())
+        if values.size == 0:
+            return
+        self.image.set_data(self.to_db(values).T)
+        self.image.set_extent(self.extent(times_view, frequencies_view))
+        ax.figure.canvas.draw_idle()
+
+
+def draw_spectrogram(fig, spectrogram, times, frequencies):
+    ax = fig.add_subplot()
+    image = SpectrogramImage(ax, spectrogram, times, frequencies)
+    fig.colorbar(image.image, ax=ax, label='Amplitude (dB)')
+    ax.set_xlabel('Time (s)')
+    ax.set_ylabel('Frequency (Hz)')
+    return ax
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Spectrogram of a wav file saved as a memory-mapped "
+                    ".npy file (frames x bins) with a .json sidecar.")
+    parser.add_argument('recording', help="wav file")
+    parser.add_argument('-o', '--output', required=True,
+                        help=".npy file to save the spectrogram")
+    parser.add_argument('--channel', type=int, default=0,
+                        help="channel of the recording")
+    parser.add_argument('--segment', type=int,
+                        default=STFT_PARAMS['segment_length'],
+                        help="segment length in samples")
+    parser.add_argument('--overlap', type=float,
+                        default=STFT_PARAMS['overlap'],
+                        help="overlap of the segments (0..1)")
+    parser.add_argument('--filter', nargs=3, type=float,
+                        metavar=('F_LOW', 'F_HIGH', 'ORDER'),
+                        help="band-pass filter parameters")
+    args = parser.parse_args()
+
+    if args.filter is not None:
+        is_filtered = True
+        filter_params = {
+            'f_low': args.filter[0],
+            'f_high': args.filter[1],
+            'order': int(args.filter[2])
+        }
+    else:
+        is_filtered = False
+        filter_params = None
+
+    stft_wav(args.recording, path2save=args.output, channel=args.channel,
+             stft_params={'segment_length': args.segment,
+                          'overlap': args.overlap},
+             is_filtered=is_filtered, filter_params=filter_params)
+
+
+if __name__ == '__main__':
+    main()
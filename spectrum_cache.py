@@ -0,0 +1,180 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# Default location and size limits of the spectrum cache:
+CACHE_PARAMS = {
+    'path': os.path.join(os.path.expanduser('~'), '.cache',
+                         'sound_toolkit', 'spectra'),
+    'memory_limit': 512 * 2 ** 20,
+    'disk_limit': 4 * 2 ** 30
+}
+
+# Version of the cached results: the cache outlives the code, so it must be
+# increased whenever the computation of the spectra changes (2: integer
+# wav samples are scaled to [-1, 1)):
+CACHE_VERSION = 2
+
+
+# Two-level (memory and disk) LRU cache of computed spectra. The entries
+# are evicted from the least recently used one when the total size exceeds
+# the limit:
+class SpectrumCache:
+    def __init__(self, path2cache=CACHE_PARAMS['path'],
+                 memory_limit=CACHE_PARAMS['memory_limit'],
+                 disk_limit=CACHE_PARAMS['disk_limit']):
+        self.path2cache = path2cache
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+
+        self.entries = OrderedDict()
+        self.memory_size = 0
+        self.lock = threading.Lock()
+
+    # Key of a file: its path, modification time and size together with
+    # all parameters that change the result and the cache version:
+    @staticmethod
+    def key(filename, hash_content=False, **params):
+        file_stat = os.stat(filename)
+        key_data = {
+            'version': CACHE_VERSION,
+            'path': os.path.realpath(filename),
+            'mtime': file_stat.st_mtime_ns,
+            'size': file_stat.st_size,
+            'params': params
+        }
+        if hash_content:
+            key_data['content'] = file_hash(filename)
+        key_string = json.dumps(key_data, sort_keys=True, default=str)
+        return hashlib.sha1(key_string.encode()).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+
+        path2entry = self.entry_path(key)
+        if self.path2cache is None or not os.path.isfile(path2entry):
+            return None
+
+        try:
+            with np.load(path2entry) as entry:
+                frequencies = entry['frequencies']
+                amplitudes = entry['amplitudes']
+        except (OSError, ValueError, KeyError):
+            # Broken entry (e.g. interrupted write) or an entry evicted by
+            # another process in the meantime:
+            try:
+                os.remove(path2entry)
+            except FileNotFoundError:
+                pass
+            return None
+
+        # Mark the entry as recently used:
+        try:
+            os.utime(path2entry)
+        except FileNotFoundError:
+            pass
+        self.put_memory(key, frequencies, amplitudes)
+        return frequencies, amplitudes
+
+    def put(self, key, frequencies, amplitudes):
+        self.put_memory(key, frequencies, amplitudes)
+
+        if self.path2cache is None:
+            return
+        os.makedirs(self.path2cache, exist_ok=True)
+        path2entry = self.entry_path(key)
+        path2tmp = '{}.{}.tmp'.format(path2entry, os.getpid())
+        with open(path2tmp, 'wb') as file2save:
+            np.savez(file2save, frequencies=frequencies,
+                     amplitudes=amplitudes)
+        os.replace(path2tmp, path2entry)
+        self.evict_disk()
+
+    def put_memory(self, key, frequencies, amplitudes):
+        # Cached arrays are shared between the callers:
+        frequencies = np.asarray(frequencies)
+        amplitudes = np.asarray(amplitudes)
+        frequencies.flags.writeable = False
+        amplitudes.flags.writeable = False
+        entry_size = frequencies.nbytes + amplitudes.nbytes
+
+        with self.lock:
+            if key in self.entries:
+                self.memory_size -= entry_nbytes(self.entries.pop(key))
+            if entry_size > self.memory_limit:
+                return
+            self.entries[key] = (frequencies, amplitudes)
+            self.memory_size += entry_size
+
+            while self.memory_size > self.memory_limit:
+                [_, entry] = self.entries.popitem(last=False)
+                self.memory_size -= entry_nbytes(entry)
+
+    def evict_disk(self):
+        entries = []
+        for entry in os.scandir(self.path2cache):
+            if entry.name.endswith('.npz'):
+                try:
+                    entry_stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((entry_stat.st_mtime, entry_stat.st_size,
+                                entry.path))
+
+        disk_size = sum(entry[1] for entry in entries)
+        for [_, entry_size, path2entry] in sorted(entries):
+            if disk_size <= self.disk_limit:
+                break
+            try:
+                os.remove(path2entry)
+            except FileNotFoundError:
+                pass
+            disk_size -= entry_size
+
+    def entry_path(self, key):
+        if self.path2cache is None:
+            return None
+        return os.path.join(self.path2cache, '{}.npz'.format(key))
+
+    def clear(self, disk=True):
+        with self.lock:
+            self.entries.clear()
+            self.memory_size = 0
+        if disk and self.path2cache is not None and \
+                os.path.isdir(self.path2cache):
+            for entry in os.scandir(self.path2cache):
+                if entry.name.endswith('.npz'):
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+
+
+def entry_nbytes(entry):
+    return sum(array.nbytes for array in entry)
+
+
+# Hash of the file content (read in blocks):
+def file_hash(filename, block_size=2 ** 20):
+    content_hash = hashlib.sha1()
+    with open(filename, 'rb') as file2hash:
+        for block in iter(lambda: file2hash.read(block_size), b''):
+            content_hash.update(block)
+    return content_hash.hexdigest()
+
+
+# Cache shared by the analyzer functions:
+default_cache = None
+
+
+def get_cache():
+    global default_cache
+    if default_cache is None:
+        default_cache = SpectrumCache()
+    return default_cache
@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import zlib
+import struct
+import numpy as np
+
+# Import local modules:
+import session_io as sio
+
+# Journal of a frequency sweep: an append-only binary log of the completed
+# steps with the amplitudes of all their cycles. The file starts with
+# JOURNAL_MAGIC, the length of a JSON header (the frequencies and the
+# parameters of the sweep) and the header; every step is a record
+#   step, frequency, cycles, channels, values, amplitudes (float64), crc32
+# A record is flushed to the system when it is written and the file is
+# synced to the disk every 'sync_interval' seconds (and when it is closed).
+# A record torn by a crash ends the journal and is overwritten when the
+# sweep is resumed.
+
+JOURNAL_PARAMS = {
+    'filename': 'sweep_journal.bin',
+    'sync_interval': 10
+}
+
+JOURNAL_MAGIC = b'SWJ1'
+HEADER_LENGTH = struct.Struct('<I')
+RECORD_HEADER = struct.Struct('<IdIII')
+RECORD_CRC = struct.Struct('<I')
+
+# Parameters which must not change when a sweep is resumed:
+RESUME_PARAMS = ['sample_rate', 'duration', 'cycles', 'cycles_pause',
+                 'channels', 'input_mapping', 'f_start', 'f_end', 'f_step',
+                 'harmonics', 'sweep_method']
+
+
+def journal_path(path2save):
+    return os.path.join(path2save, JOURNAL_PARAMS['filename'])
+
+
+# Header, completed steps {step: (frequency, amplitudes [cycles, channels,
+# values])} and the size of the valid part of a journal:
+def read_journal(filename):
+    with open(filename, 'rb') as file2read:
+        data = file2read.read()
+
+    header_start = len(JOURNAL_MAGIC) + HEADER_LENGTH.size
+    if data[:len(JOURNAL_MAGIC)] != JOURNAL_MAGIC or \
+            len(data) < header_start:
+        raise ValueError("Not a sweep journal: {}".format(filename))
+    [header_length] = HEADER_LENGTH.unpack_from(data, len(JOURNAL_MAGIC))
+    offset = header_start + header_length
+    header = json.loads(data[header_start:offset].decode('utf-8'))
+
+    steps = {}
+    while offset + RECORD_HEADER.size <= len(data):
+        [step, freq, cycles, channels, values] = \
+            RECORD_HEADER.unpack_from(data, offset)
+        record_end = offset + RECORD_HEADER.size + \
+            8 * cycles * channels * values
+        if record_end + RECORD_CRC.size > len(data):
+            break
+        [crc] = RECORD_CRC.unpack_from(data, record_end)
+        if crc != zlib.crc32(data[offset:record_end]):
+            break
+        steps[step] = (freq, np.frombuffer(
+            data, dtype='<f8', count=cycles * channels * values,
+            offset=offset + RECORD_HEADER.size).reshape(
+                cycles, channels, values))
+        offset = record_end + RECORD_CRC.size
+
+    return header, steps, offset
+
+
+# JSON values of the parameters as they are read from a journal:
+def json_params(wf_params):
+    return json.loads(json.dumps(wf_params, default=sio.json_default))
+
+
+class SweepJournal:
+    # With resume=True the steps of an existing journal of the same sweep
+    # are kept (ValueError for a journal of another sweep):
+    def __init__(self, filename, freq_array, wf_params, resume=False,
+                 sync_interval=JOURNAL_PARAMS['sync_interval']):
+        self.filename = filename
+        self.sync_interval = sync_interval
+        self.header = json_params({'frequencies': list(freq_array),
+                                   'wf_params': wf_params})
+        self.steps = {}
+
+        if resume and os.path.isfile(filename):
+            [header, self.steps, valid_size] = read_journal(filename)
+            self.check_header(header)
+            self.file = open(filename, 'r+b')
+            self.file.truncate(valid_size)
+            self.file.seek(valid_size)
+        else:
+            header = json.dumps(self.header).encode('utf-8')
+            self.file = open(filename, 'wb')
+            self.file.write(JOURNAL_MAGIC + HEADER_LENGTH.pack(len(header)) +
+                            header)
+        self.sync()
+
+    def check_header(self, header):
+        if header['frequencies'] != self.header['frequencies']:
+            raise ValueError("The journal {} belongs to a sweep over other "
+                             "frequencies".format(self.filename))
+        for param in RESUME_PARAMS:
+            if header['wf_params'].get(param) != \
+                    self.header['wf_params'].get(param):
+                raise ValueError("The journal {} belongs to a sweep with "
+                                 "another '{}'".format(self.filename, param))
+
+    # Amplitudes of all cycles of a step [cycles, channels, values]:
+    def append(self, step, freq, amplitudes):
+        amplitudes = np.ascontiguousarray(amplitudes, dtype='<f8')
+        record = RECORD_HEADER.pack(step, freq, *amplitudes.shape) + \
+            amplitudes.tobytes()
+        self.file.write(record + RECORD_CRC.pack(zlib.crc32(record)))
+        self.file.flush()
+        self.steps[step] = (freq, amplitudes)
+        if time.monotonic() - self.last_sync >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        self.sync()
+        self.file.close()
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+from scipy.io import wavfile
+from scipy.signal import chirp
+
+# Import local modules:
+import analyzer as an
+import spectrum_cache as sc
+import tl_batch as tb
+
+# Transmission loss of equal-level recordings must be about 0 dB, also when
+# the recordings have different lengths. Run with: python -m pytest test_tl.py
+
+SAMPLE_RATE = 48000
+# Frequency range of the checks (away from the ends of the chirp):
+F_RANGE = [100, 15000]
+
+
+# Spectra are not cached, so that nothing is written to the user's cache:
+@pytest.fixture(autouse=True)
+def disabled_cache(monkeypatch):
+    monkeypatch.setattr(sc, 'default_cache',
+                        sc.SpectrumCache(path2cache=None, memory_limit=0))
+
+
+def write_wav(filename, audio_signal):
+    wavfile.write(str(filename), SAMPLE_RATE, audio_signal)
+    return str(filename)
+
+
+def in_range(frequencies):
+    return (frequencies > F_RANGE[0]) & (frequencies < F_RANGE[1])
+
+
+@pytest.fixture
+def chirp_files(tmp_path):
+    timestamps = np.arange(SAMPLE_RATE) / SAMPLE_RATE
+    audio_signal = 0.5 * chirp(timestamps, 20, 1, 20000)
+    filename_reference = write_wav(tmp_path / 'chirp.wav', audio_signal)
+    # The same chirp followed by 1 s of silence:
+    filename_signal = write_wav(
+        tmp_path / 'chirp_silence.wav',
+        np.concatenate([audio_signal, np.zeros(SAMPLE_RATE)]))
+    return filename_signal, filename_reference
+
+
+def test_tl_chirp_trailing_silence(chirp_files):
+    [filename_signal, filename_reference] = chirp_files
+    [transmission_loss, frequencies] = an.get_tl(
+        filename_signal, filename_reference, is_plotted=False)
+    assert abs(np.median(transmission_loss[in_range(frequencies)])) < 0.1
+
+
+def test_tl_bands_chirp_trailing_silence(chirp_files):
+    [filename_signal, filename_reference] = chirp_files
+    [transmission_loss, frequencies] = an.get_tl(
+        filename_signal, filename_reference, is_plotted=False, bands=3)
+    assert np.all(np.abs(transmission_loss[in_range(frequencies)]) < 0.1)
+
+
+def test_tl_batch_chirp_trailing_silence(chirp_files):
+    [filename_signal, filename_reference] = chirp_files
+    [transmission_loss, frequencies] = tb.get_tl_batch(
+        [filename_signal], filename_reference, processes=1, bands=3)
+    assert np.all(np.abs(transmission_loss[0, in_range(frequencies)]) < 0.1)
+
+
+@pytest.mark.parametrize('name', ['tone', 'noise'])
+def test_tl_equal_length(tmp_path, name):
+    timestamps = np.arange(2 * SAMPLE_RATE) / SAMPLE_RATE
+    if name == 'tone':
+        audio_signal = 0.5 * np.sin(2 * np.pi * 1000 * timestamps)
+    else:
+        audio_signal = 0.3 * np.random.default_rng(0).standard_normal(
+            len(timestamps))
+    # Two recordings of the same level:
+    filename_signal = write_wav(tmp_path / 'signal.wav',
+                                audio_signal[:SAMPLE_RATE])
+    filename_reference = write_wav(tmp_path / 'reference.wav',
+                                   audio_signal[SAMPLE_RATE:])
+    [transmission_loss, frequencies] = an.get_tl(
+        filename_signal, filename_reference, is_plotted=False, bands=3)
+    idx = np.argmin(np.abs(frequencies - 1000))
+    assert abs(transmission_loss[idx]) < 0.5
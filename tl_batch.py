@@ -0,0 +1,187 @@
+import os
+import json
+import argparse
+import functools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# Import local modules:
+import analyzer as an
+import bands as bd
+
+
+# Transmission loss of many recordings against their references. Every
+# reference spectrum is computed once; the signal spectra are loaded in a
+# process pool and stacked, so that 20*log10(signal/reference) is computed
+# for a whole group of recordings at once. With bands (e.g. 3 for 1/3
+# octave) the rows are the transmission loss of the fractional-octave bands.
+# Nothing is plotted.
+def get_tl_batch(filenames_signal, filenames_reference,
+                 is_filtered=False, filter_params=None,
+                 spectrum_mode='fft', welch_params=None,
+                 processes=None, batch_size=64, path2save=None, bands=None):
+
+    # A single reference may be given for all recordings:
+    if isinstance(filenames_reference, str):
+        filenames_reference = [filenames_reference] * len(filenames_signal)
+    if len(filenames_reference) != len(filenames_signal):
+        raise ValueError("Each recording must have a reference!")
+
+    references = list(dict.fromkeys(filenames_reference))
+
+    # Recordings with other sample rates are resampled to the rate of the
+    # first reference:
+    sample_rate = an.wav_sample_rate(references[0]) \
+        if spectrum_mode == 'fft' else None
+    load_spectrum = functools.partial(an.load_signal,
+                                      is_filtered=is_filtered,
+                                      filter_params=filter_params,
+                                      spectrum_mode=spectrum_mode,
+                                      welch_params=welch_params,
+                                      sample_rate=sample_rate)
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        reference_spectra = \
+            dict(zip(references, executor.map(load_spectrum, references)))
+
+        # All results share the frequency axis of the first reference:
+        frequencies = reference_spectra[references[0]][0]
+        if bands is not None:
+            band_map = bd.get_band_map(
+                frequencies, fraction=bands,
+                **an.band_range(frequencies, is_filtered, filter_params))
+            [frequencies_bins, frequencies] = [frequencies, band_map.centers]
+        else:
+            frequencies_bins = frequencies
+        if path2save is None:
+            transmission_loss = \
+                np.empty([len(filenames_signal), len(frequencies)])
+        else:
+            os.makedirs(path2save, exist_ok=True)
+            np.save('{}/frequencies.npy'.format(path2save), frequencies)
+            transmission_loss = np.lib.format.open_memmap(
+                '{}/transmission_loss.npy'.format(path2save), mode='w+',
+                shape=(len(filenames_signal), len(frequencies)))
+
+        for reference in references:
+            # Spectra on other frequency axes (other lengths or sample
+            # rates) are interpolated to the common one (NaN outside of
+            # their frequency range):
+            [reference_frequencies, reference_amplitudes] = \
+                reference_spectra[reference]
+            reference_amplitudes = an.interpolate_spectrum(
+                reference_frequencies, reference_amplitudes, frequencies_bins)
+            rows = [idx for idx, filename in enumerate(filenames_reference)
+                    if filename == reference]
+            if bands is not None:
+                reference_amplitudes = np.sqrt(
+                    band_map.reduce(np.square(reference_amplitudes)))
+
+            for batch_start in range(0, len(rows), batch_size):
+                batch_rows = rows[batch_start:batch_start + batch_size]
+                batch_files = [filenames_signal[idx] for idx in batch_rows]
+
+                # Stacked signal spectra of the batch:
+                signal_amplitudes = \
+                    np.empty([len(batch_rows), len(frequencies_bins)])
+                for idx, [signal_frequencies, amplitudes] in \
+                        enumerate(executor.map(load_spectrum, batch_files)):
+                    signal_amplitudes[idx, :] = an.interpolate_spectrum(
+                        signal_frequencies, amplitudes, frequencies_bins)
+
+                if bands is not None:
+                    # Band amplitudes of the whole batch at once:
+                    signal_amplitudes = np.sqrt(
+                        band_map.reduce(np.square(signal_amplitudes)))
+
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    transmission_loss[batch_rows, :] = 20 * np.log10(
+                        signal_amplitudes / reference_amplitudes[np.newaxis, :])
+
+    if path2save is not None:
+        transmission_loss.flush()
+        with open('{}/transmission_loss.json'.format(path2save), 'w') as \
+                file2save:
+            json.dump({
+                'rows': [{'signal': filename_signal,
+                          'reference': filename_reference}
+                         for filename_signal, filename_reference in
+                         zip(filenames_signal, filenames_reference)],
+                'is_filtered': is_filtered,
+                'filter_params': filter_params,
+                'spectrum_mode': spectrum_mode,
+                'welch_params': welch_params,
+                'bands': bands
+            }, file2save, indent=4)
+
+    return transmission_loss, frequencies
+
+
+# Read pairs "recording, reference" (one pair per line):
+def read_pairs(filename):
+    filenames_signal = []
+    filenames_reference = []
+    with open(filename) as file2read:
+        for line in file2read:
+            line = line.strip()
+            if line == '' or line.startswith('#'):
+                continue
+            [filename_signal, filename_reference] = \
+                [item.strip() for item in line.split(',')]
+            filenames_signal.append(filename_signal)
+            filenames_reference.append(filename_reference)
+    return filenames_signal, filenames_reference
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Transmission loss of many recordings against "
+                    "references (results are saved, nothing is plotted).")
+    parser.add_argument('signals', nargs='*',
+                        help="files with recordings")
+    parser.add_argument('-r', '--reference',
+                        help="file with the reference for all recordings")
+    parser.add_argument('--pairs',
+                        help="text file with 'recording, reference' lines")
+    parser.add_argument('-o', '--output', required=True,
+                        help="directory to save the results")
+    parser.add_argument('--filter', nargs=3, type=float,
+                        metavar=('F_LOW', 'F_HIGH', 'ORDER'),
+                        help="band-pass filter parameters")
+    parser.add_argument('--welch', action='store_true',
+                        help="use the averaged (Welch) spectrum")
+    parser.add_argument('--bands', type=int,
+                        help="fractional-octave bands (1 for octaves, "
+                             "3 for 1/3 octaves)")
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help="number of worker processes")
+    args = parser.parse_args()
+
+    if args.pairs is not None:
+        [filenames_signal, filenames_reference] = read_pairs(args.pairs)
+    elif args.reference is not None and args.signals:
+        filenames_signal = args.signals
+        filenames_reference = args.reference
+    else:
+        parser.error("Give recordings with --reference or use --pairs")
+
+    if args.filter is not None:
+        is_filtered = True
+        filter_params = {
+            'f_low': args.filter[0],
+            'f_high': args.filter[1],
+            'order': int(args.filter[2])
+        }
+    else:
+        is_filtered = False
+        filter_params = None
+
+    get_tl_batch(filenames_signal, filenames_reference,
+                 is_filtered=is_filtered, filter_params=filter_params,
+                 spectrum_mode='welch' if args.welch else 'fft',
+                 processes=args.processes, path2save=args.output,
+                 bands=args.bands)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+import os
+import queue
+import struct
+import threading
+import numpy as np
+
+# Export of the recorded cycles as wav files. The sample format is 'int16',
+# 'int24' or 'float32' and the cycles are saved
+#   'files'     one file per cycle (recorded_signal_{cycle}.wav)
+#   'channels'  one file, the channels of all cycles side by side
+#   'segments'  one file, the cycles one after another
+# A file is allocated with its final size when its first cycle is written
+# and every cycle is written to its place by a background thread as soon as
+# it is recorded. If not all cycles are written (a cancelled or failed
+# recording), close() removes the incomplete files: the 'segments' file is
+# truncated to the written cycles, a 'channels' file is removed.
+
+EXPORT_PARAMS = {
+    'sample_format': 'float32',
+    'cycles_layout': 'files'
+}
+
+# Format tag, bytes per sample and full scale of the sample formats:
+SAMPLE_FORMATS = {
+    'int16': (1, 2, 2 ** 15 - 1),
+    'int24': (1, 3, 2 ** 23 - 1),
+    'float32': (3, 4, None)
+}
+
+WAV_HEADER_SIZE = 44
+
+
+def wav_header(sample_rate, channels, frames, sample_format='float32'):
+    [format_tag, sample_size, _] = SAMPLE_FORMATS[sample_format]
+    data_size = frames * channels * sample_size
+    return struct.pack('<4sI4s4sIHHIIHH4sI',
+                       b'RIFF', 36 + data_size, b'WAVE',
+                       b'fmt ', 16, format_tag, channels, int(sample_rate),
+                       int(sample_rate) * channels * sample_size,
+                       channels * sample_size, 8 * sample_size,
+                       b'data', data_size)
+
+
+# Little-endian bytes of the samples [..., channels] as an array
+# [..., channels, sample size] (integer formats are clipped to full scale):
+def encode_samples(data, sample_format='float32'):
+    [_, sample_size, full_scale] = SAMPLE_FORMATS[sample_format]
+    if full_scale is None:
+        encoded = np.ascontiguousarray(data, dtype='<f4')
+    else:
+        encoded = np.ascontiguousarray(
+            np.round(np.clip(data, -1, 1) * full_scale), dtype='<i4')
+    return encoded[..., np.newaxis].view('u1')[..., :sample_size]
+
+
+# Wav file allocated for the given size; the samples are written to any
+# position through a memory map of the data:
+class WavFile:
+    def __init__(self, filename, sample_rate, channels, frames,
+                 sample_format='float32'):
+        self.filename = filename
+        self.sample_format = sample_format
+        sample_size = SAMPLE_FORMATS[sample_format][1]
+
+        with open(filename, 'wb') as file2save:
+            file2save.write(
+                wav_header(sample_rate, channels, frames, sample_format))
+            file2save.truncate(WAV_HEADER_SIZE +
+                               frames * channels * sample_size)
+        self.data = np.memmap(filename, dtype='u1', mode='r+',
+                              offset=WAV_HEADER_SIZE,
+                              shape=(frames, channels, sample_size))
+
+    # Samples [frames, channels] starting at the frame, in the channels
+    # starting at the channel:
+    def write(self, samples, frame=0, channel=0):
+        encoded = encode_samples(samples, self.sample_format)
+        self.data[frame:frame + encoded.shape[0],
+                  channel:channel + encoded.shape[1]] = encoded
+
+    def close(self):
+        self.data.flush()
+        del self.data
+
+
+# Truncate a wav file to the given number of frames:
+def truncate_wav(filename, sample_rate, channels, frames,
+                 sample_format='float32'):
+    sample_size = SAMPLE_FORMATS[sample_format][1]
+    with open(filename, 'r+b') as file2save:
+        file2save.write(
+            wav_header(sample_rate, channels, frames, sample_format))
+        file2save.truncate(WAV_HEADER_SIZE + frames * channels * sample_size)
+
+
+# Writer of the recorded cycles ([channels, samples] each) in a background
+# thread. Errors of the thread are raised by close():
+class CycleWriter:
+    def __init__(self, path2save, sample_rate, channels, samples, cycles,
+                 sample_format=EXPORT_PARAMS['sample_format'],
+                 cycles_layout=EXPORT_PARAMS['cycles_layout']):
+        self.path2save = path2save
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.samples = samples
+        self.cycles = cycles
+        self.sample_format = sample_format
+        self.cycles_layout = cycles_layout
+
+        # Channels and frames of the files:
+        if cycles_layout == 'files':
+            self.filenames = ["recorded_signal_{}.wav".format(cycle)
+                              for cycle in range(0, cycles)]
+            self.file_shape = [channels, samples]
+        elif cycles_layout in ['channels', 'segments']:
+            self.filenames = ["recorded_signals.wav"]
+            self.file_shape = [channels * cycles, samples] \
+                if cycles_layout == 'channels' else \
+                [channels, samples * cycles]
+        else:
+            raise ValueError(
+                "Unknown layout of the cycles: {}".format(cycles_layout))
+        # Files opened so far and the cycles written completely:
+        self.files = {}
+        self.cycles_written = []
+
+        self.queue = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, cycle, signal_recorded):
+        self.queue.put((cycle, signal_recorded))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is not None:
+                continue
+            [cycle, signal_recorded] = item
+            try:
+                self.write_cycle(cycle, np.asarray(signal_recorded).T)
+            except Exception as error:
+                self.error = error
+
+    def write_cycle(self, cycle, samples):
+        if self.cycles_layout == 'files':
+            self.open_file(cycle).write(samples)
+        elif self.cycles_layout == 'channels':
+            self.open_file(0).write(samples, channel=cycle * self.channels)
+        else:
+            self.open_file(0).write(samples, frame=cycle * self.samples)
+        self.cycles_written.append(cycle)
+
+    def open_file(self, idx):
+        if idx not in self.files:
+            self.files[idx] = WavFile(
+                os.path.join(self.path2save, self.filenames[idx]),
+                self.sample_rate, *self.file_shape, self.sample_format)
+        return self.files[idx]
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        for wav_file in self.files.values():
+            wav_file.close()
+        if len(self.cycles_written) < self.cycles:
+            self.remove_unwritten()
+        if self.error is not None:
+            raise self.error
+
+    # Only the completely written cycles are kept (filenames lists the
+    # files left):
+    def remove_unwritten(self):
+        if self.cycles_layout == 'files':
+            for [cycle, wav_file] in self.files.items():
+                if cycle not in self.cycles_written:
+                    os.remove(wav_file.filename)
+            self.filenames = [self.filenames[cycle]
+                              for cycle in sorted(self.cycles_written)]
+        elif self.cycles_layout == 'segments' and self.cycles_written:
+            # The cycles are written in their order:
+            truncate_wav(self.files[0].filename, self.sample_rate,
+                         self.channels,
+                         len(self.cycles_written) * self.samples,
+                         self.sample_format)
+        else:
+            for wav_file in self.files.values():
+                os.remove(wav_file.filename)
+            self.filenames = []